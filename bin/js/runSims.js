@@ -10,6 +10,7 @@ const shell = require("shelljs"),
 			files = require('./files');
 
 let INPUTS_FILENAME = path.join('MC','inputs','input_data.json');
+let BATCH_DIR = path.join('MC','batch');
 
 let error = (msg,stdout="") => {
 	process.stdout.clearLine();
@@ -53,17 +54,38 @@ module.exports = (argv) => {
 			'./MC/results/breakdown',
 			'./MC/results/cumulative',
 			'./MC/results/summary',
-			'./MC/input_variation'
+			'./MC/input_variation',
+			BATCH_DIR
 		];
 
 		for(let i = 0; i < outputDirs.length; i++){
 			fsx.emptyDirSync(outputDirs[i]);
 		}
+		if (argv.database && fs.existsSync(argv.database)) {
+			fs.unlinkSync(argv.database);
+		}
 
 		let start = new Date();
         let res = null;
         let i0 = argv.start
         let i1 = ITERATIONS+i0-1
+		let batchMade = false;
+		/* a Latin hypercube or Sobol design spans simulations 1 to designSize, by default i1;
+		   chunks of one run share the design by giving the same --design-size */
+		let designArgs = '';
+		let designSize = argv.designSize || i1;
+		if (argv.design && argv.design !== 'random') {
+			if (!argv.seed) {
+				error(`--design ${argv.design} requires a seed`);
+			}
+			if (designSize < i1) {
+				error(`--design-size ${designSize} is less than the last simulation, ${i1}`);
+			}
+			designArgs = ` --design ${argv.design} --design-size ${designSize}`;
+		}
+		if (argv.antithetic) {
+			designArgs += ' --antithetic';
+		}
 		for (let i = i0; i <= i1; i++){
 
 			let startIter = new Date();
@@ -75,6 +97,26 @@ module.exports = (argv) => {
 					error("montecarlo.py run failed",res.stdout);
 				}
 			}
+			else if (argv.batch) {
+				/* generate the inputs for all remaining simulations with one python process
+				 * and then just copy each simulation's files into place.  montecarlo.py writes
+				 * the simulation number to inp.txt itself in this mode.
+				 */
+				if (!batchMade) {
+					let cmd = py + ` ${__dirname}/../python/montecarlo.py -s --batch ${i} ${i1-i+1} --outdir ${BATCH_DIR}`
+					if (argv.seed)
+						cmd += ` --seed ${argv.seed}`
+					cmd += designArgs;
+					res = shell.exec(cmd,{silent:true});
+					if (res.code !== 0) {
+						error("montecarlo.py batch run failed",res.stderr);
+					}
+					batchMade = true;
+				}
+				let iterDir = path.join(BATCH_DIR, String(i));
+				fsx.copySync(iterDir, '.');
+				fsx.removeSync(iterDir);
+			}
 			else {
 				let str = String(i + ' '.repeat(16));
 				let INP_OUTPUT_FILE = './MC/input_variation/inp.txt';
@@ -84,6 +126,7 @@ module.exports = (argv) => {
                 let cmd = py + ` ${__dirname}/../python/montecarlo.py -s -i ${i}`
                 if (argv.seed)
                     cmd += ` --seed ${argv.seed}`
+                cmd += designArgs;
 				res = shell.exec(cmd,{silent:true});
 				if (res.code !== 0) {
 					error("montecarlo.py run failed",res.stderr);
@@ -93,7 +136,10 @@ module.exports = (argv) => {
 			for (let j = 0; j < dat_files.length; j++){
 				let baseName = `${dat_files[j]}_mc.dat`;
 				let datFile = path.join('modfile', baseName);
-				files.copy(datFile, `MC\\input_variation\\dat_files\\${dat_files[j]}_${i}.dat`);
+				if (argv.datCopies) {
+					/* the values are also in the binary archive MC/input_variation/draws */
+					files.copy(datFile, `MC\\input_variation\\dat_files\\${dat_files[j]}_${i}.dat`);
+				}
 				if (baseName.length > 12) {
 					/* The fortran program assumes file names are 12 characters max,
 					 * truncating all names that are longer.  So that it can find the inputs,
@@ -135,20 +181,48 @@ module.exports = (argv) => {
 					error("Model run failed",res.stderr);
 				}
 
-				res = shell.exec(py+` ${__dirname}/../python/format.py ${outfile}`,{silent:true});
+				/* the zero run also refreshes the cached block offsets */
+				let formatCmd = py+` ${__dirname}/../python/format.py ${outfile} --iteration ${i}`;
+				if (argv.database) {
+					/* append the values straight to the database frmtToData.py would build */
+					formatCmd += ` --database ${argv.database} --scenario ${inp_files[j]}`;
+					if (!argv.frmt) {
+						formatCmd += ' --no-frmt';
+					}
+				}
+				res = shell.exec(formatCmd,{silent:true});
 				if (res.code !== 0) {
 					error("format.py run failed",res.stdout);
 				}
 
-				let formattedFile = `${outfile}.frmt`;
-				let formattedSaveFile = path.join('MC/results/breakdown',`${inp_files[j]}_${i}.frmt`);
+				if (argv.frmt || !argv.database) {
+					let formattedFile = `${outfile}.frmt`;
+					let formattedSaveFile = path.join('MC/results/breakdown',`${inp_files[j]}_${i}.frmt`);
 
-				files.copy(formattedFile,formattedSaveFile);
+					files.copy(formattedFile,formattedSaveFile);
+				}
 
 				let outputSaveFile = path.join('MC/results/cumulative',`${inp_files[j]}_${i}.dat`); 
 				files.copy('outfile.dat',outputSaveFile);
 
 			}
+
+			if (inputsData['monitor'] && i > 0) {
+				/* update the running statistics; exit code 3 means they are precise enough */
+				res = shell.exec(py+` ${__dirname}/../python/monitor.py -i ${i}`,{silent:true});
+				if (res.code === 3) {
+					process.stdout.clearLine();
+					process.stdout.cursorTo(0);
+					console.log(`converged after simulation ${i}`.green);
+					console.log(res.stdout);
+					i1 = i;
+					ITERATIONS = i1 - i0 + 1;
+					break;
+				}
+				if (res.code !== 0) {
+					error("monitor.py run failed",res.stderr);
+				}
+			}
 			let endIter = new Date();
 
 			lastTime = endIter.getTime() - startIter.getTime();
@@ -179,7 +253,10 @@ module.exports = (argv) => {
                 dat_files: inputsData.dat_files.map((fileData) => fileData.filename),
                 i0: i0,
                 i1: i1,
-            seed: argv.seed
+            seed: argv.seed,
+            design: argv.design,
+            designSize: argv.design && argv.design !== 'random' ? designSize : undefined,
+            antithetic: argv.antithetic
 		};
 		fs.appendFileSync('MC/results/.run',JSON.stringify(runData, null, 4));
 		console.log(`  simulations completed in ${hours>0 ? hours + ' hours and ' : ''}${minutes} mintues!`.green)
@@ -30,6 +30,46 @@ let argv = yargs
                 ' across simulations.',
             type: 'number'
         })
+        .option('batch', {
+            describe: 'generate the varied inputs for all simulations with a single python process ' +
+                'before running the model, instead of one process per simulation',
+            type: 'boolean',
+            default: false
+        })
+        .option('design', {
+            describe: 'how to sample the inputs: independent random draws, a Latin hypercube, ' +
+                'or a scrambled Sobol sequence.  lhs and sobol need a seed, and cover simulations 1 to start+iterations-1.',
+            choices: ['random', 'lhs', 'sobol'],
+            default: 'random'
+        })
+        .option('design-size', {
+            describe: 'last simulation the lhs or sobol design covers [default start+iterations-1].  ' +
+                'When a run is done in chunks, give every chunk the last simulation of the whole run, ' +
+                'so together they make one design.',
+            type: 'number'
+        })
+        .option('antithetic', {
+            describe: 'draw simulations in antithetic pairs: each even simulation reflects the random values ' +
+                'of the one before it.  Use an even number of simulations.',
+            type: 'boolean',
+            default: false
+        })
+        .option('database', {
+            describe: 'after each model run also append the results to this SQLite database, in the form ' +
+                'frmtToData.py produces.  Any existing file is deleted at the start of the run.',
+            type: 'string'
+        })
+        .option('frmt', {
+            describe: 'keep the .frmt files in MC/results/breakdown.  --no-frmt skips them when --database is given.',
+            type: 'boolean',
+            default: true
+        })
+        .option('dat-copies', {
+            describe: 'also keep a copy of every varied dat file in MC/input_variation/dat_files. ' +
+                'The varied values are always saved in MC/input_variation/draws.',
+            type: 'boolean',
+            default: false
+        })
         .epilog("All numbers should be unsigned integers."),
     handler: runSims,
 })
@@ -0,0 +1,249 @@
+# The ageranges_*.csv reports of frmtReport.py, and writing all of them without the GUI
+# File: ageranges.py
+#
+# frmtReport.py --all, or this file run directly, writes the report of every variable and subcategory
+# in a database made by frmtToData.py, or a catalog made by catalog.py, without PySide2.
+# It reads the sums over years in one pass, in (fullvarid, scenario, iSim) order, from yeartotal if the
+# database has it or else by summing data.  Each variable's rows go to a pool of processes that build the
+# pandas frames and write the files.  The files are the same as those of clicking each variable in the GUI.
+
+import argparse
+from collections import deque
+from datetime import datetime
+from itertools import groupby
+import multiprocessing
+import os.path
+import re
+from socket import getfqdn
+import sqlite3
+import numpy as np
+import pandas as pd
+import catalog
+
+parser = argparse.ArgumentParser(description="Write the ageranges_*.csv report of every variable, without the GUI")
+parser.add_argument("--all", action="store_true", help="all variables; the only choice at present")
+parser.add_argument("--database", default="allData.db", help="""database made by frmtToData.py, or a catalog
+of them made by catalog.py [default %(default)s]""")
+parser.add_argument("--outDir", default=".", help="directory for the reports [default %(default)s]")
+parser.add_argument("--jobs", type=int, default=None, help="number of processes writing reports [default: one per CPU]")
+parser.add_argument("--antithetic", action="store_true", help="""simulations 2k-1 and 2k were drawn as antithetic
+pairs (montecarlo.py --antithetic); add the pair mean and its standard error to the statistics""")
+
+
+def openReport(outDir, var, subcat, inName):
+    "open an appropriately named file for var/subcat and write its first line"
+    if subcat == "-":
+        name = var
+    else:
+        name = "{}_{}".format(var, subcat)
+    name = re.sub("/", " or ", name)
+    fname = "ageranges_{}.csv".format(name)
+    fout = open(os.path.join(outDir, fname), "wt")
+    if subcat == "-":
+        fout.write(var)
+    else:
+        fout.write("{}: {}".format(var, subcat))
+    fout.write(" Summary created by frmReport.py run at {} on {}. {} -> {}.\n".format(datetime.now(),
+                    getfqdn(), inName,  fname))
+    return fout
+
+def addTotals(df):
+    """add columns with totals for both sexes and overall.
+    df is modified in place and returned"""
+    for sex in ("F", "M"):
+        cnms = df.columns
+        idx = [i for i in range(len(cnms)) if (cnms[i].startswith(sex) and cnms[i][1].isdigit())]
+        df.insert(df.shape[1], sex+" (all)", df.iloc[:, idx].sum(axis=1))
+    ncol = df.shape[1]
+    # iloc arguments must be [] not ()
+    df.insert(ncol, "Everyone", df.iloc[:, [ncol-2, ncol-1]].sum(axis=1))
+    return df
+
+def addStats(df, sims, antithetic=False):
+    """Return df with statistics for each column at the top
+    sims are the simulation numbers of the rows of df"""
+    # for now ignore requested stats and just give all
+    # the dtype of most columns, even the numbers, is object
+    # so filtering based on dtype won't work
+    aSumDF = df.iloc[:, 1:].describe(percentiles=(0.05, .10, .25, .5, .75, .9, .95))
+    if antithetic:
+        aSumDF = pd.concat([aSumDF, pairStats(df, sims)])
+    aSumDF.insert(0, "file", df.iloc[0, 0])
+    return pd.concat([aSumDF, df])
+
+def pairStats(df, sims):
+    """Return DataFrame with rows "pair mean" and "pair se" for antithetic pairs.
+    Simulations 2k-1 and 2k are pair k.  The pair averages are independent, so
+    the standard error of the mean is their sd over the square root of the number of pairs.
+    Simulations without a partner, including the zero run, are left out."""
+    values = df.iloc[:, 1:].astype(float)
+    values.index = sims
+    odd = [s for s in sims if s % 2 == 1 and s+1 in values.index]
+    pairs = (values.loc[odd].to_numpy() + values.loc[[s+1 for s in odd]].to_numpy())/2
+    nPairs = pairs.shape[0]
+    se = pairs.std(axis=0, ddof=1)/np.sqrt(nPairs) if nPairs > 1 else np.full(pairs.shape[1], np.nan)
+    return pd.DataFrame([pairs.mean(axis=0), se], index=["pair mean", "pair se"], columns=values.columns)
+
+def writeFrame(fout, df):
+    "write df as csv with \\n line ends; pandas 1.5 renamed line_terminator to lineterminator"
+    # float_format=(lambda a : np.format_float_positional(a, precision=2)) worked with to_string, but with
+    # to_csv it yields TypeError: only size-1 arrays can be converted to Python scalars
+    try:
+        df.to_csv(fout, lineterminator="\n")
+    except TypeError:
+        df.to_csv(fout, line_terminator="\n")
+
+
+## writing all the reports
+
+def _open(dbase):
+    "Return (connection, True if dbase is a catalog)"
+    if catalog.isCatalog(dbase):
+        return catalog.connect(dbase), True
+    return sqlite3.connect(dbase), False
+
+def _hasTotals(conn):
+    try:
+        conn.execute("SELECT 1 FROM yeartotal LIMIT 1;")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+def demoColumns(conn, hasTotals):
+    """Return (labels, position) for the columns of a report.
+    The GUI has always ordered the age/sex columns by label, and the totals follow them.
+    position[demoid] is the index in labels of demoid."""
+    labels = conn.execute("SELECT demoid, label FROM demo WHERE demoid <= 12 ORDER BY label;").fetchall()
+    if hasTotals:
+        labels += conn.execute("SELECT demoid, label FROM demo WHERE demoid > 12 ORDER BY demoid;").fetchall()
+    position = np.full(max(d for d, _ in labels) + 1, -1, dtype=np.intp)
+    position[[d for d, _ in labels]] = np.arange(len(labels))
+    return [label for _, label in labels], position
+
+def pivot(label, iSim, column, value, columns, hasTotals):
+    """Return (DataFrame, simulation numbers) for one scenario, one row per simulation.
+    iSim, column and value are arrays giving each sum over years and its column in columns.
+    Columns without any value are left out; without hasTotals the totals are computed here."""
+    sims, row = np.unique(iSim, return_inverse=True)
+    values = np.full((len(sims), len(columns)), np.nan)
+    values[row, column] = value
+    used = np.zeros(len(columns), dtype=bool)
+    used[column] = True
+    df = pd.DataFrame(values[:, used], columns=[c for c, u in zip(columns, used) if u])
+    df.insert(0, "file", label)
+    if not hasTotals:
+        addTotals(df)
+    return df, list(sims)
+
+def scenarioFrame(conn, fullvarid, scenario, run=None, hasTotals=None):
+    """Return (DataFrame, simulation numbers) for one variable and scenario from conn, an sqlite3 connection
+    run is the name of the run in a catalog, None for a plain database
+    hasTotals is whether the database has yeartotal; None to find out"""
+    if hasTotals is None:
+        hasTotals = _hasTotals(conn)
+    where = "fullvarid = ? AND scenario = ?"
+    params = [fullvarid, scenario]
+    label = scenario
+    if run is not None:
+        where += " AND run = ?"
+        params.append(run)
+        label = "{}/{}".format(run, scenario)
+    if hasTotals:
+        sql = "SELECT iSim, demoid, value FROM yeartotal WHERE " + where + ";"
+    else:
+        sql = "SELECT iSim, demoid, TOTAL(value) FROM data WHERE " + where + " GROUP BY iSim, demoid;"
+    rows = np.array(conn.execute(sql, params).fetchall(), dtype=np.float64).reshape(-1, 3)
+    columns, position = demoColumns(conn, hasTotals)
+    return pivot(label, rows[:, 0].astype(np.intp), position[rows[:, 1].astype(np.intp)], rows[:, 2],
+                 columns, hasTotals)
+
+def reportAll(dbase, outDir=".", jobs=None, antithetic=False):
+    """Write the report of every variable and subcategory in dbase to outDir.
+    Return the number of files written."""
+    conn, isCatalog = _open(dbase)
+    run = "run" if isCatalog else "NULL"
+    names = conn.execute("SELECT fullvarid, name, subCat FROM fullvar JOIN variable USING (varid) "
+                         "ORDER BY fullvarid;").fetchall()
+    hasTotals = _hasTotals(conn)
+    columns, position = demoColumns(conn, hasTotals)
+    if hasTotals:
+        ranges = {(r[0], r[1], r[2]): (r[3], r[4]) for r in conn.execute(
+            "SELECT fullvarid, {0}, scenario, min(year), max(year) FROM data GROUP BY fullvarid, {0}, scenario;".format(run))}
+        q = conn.execute("SELECT fullvarid, {0}, scenario, iSim, demoid, value, NULL, NULL FROM yeartotal "
+                         "ORDER BY fullvarid, {0}, scenario, iSim;".format(run))
+    else:
+        ranges = None
+        q = conn.execute("SELECT fullvarid, {0}, scenario, iSim, demoid, TOTAL(value), min(year), max(year) FROM data "
+                         "GROUP BY fullvarid, {0}, scenario, iSim, demoid "
+                         "ORDER BY fullvarid, {0}, scenario, iSim;".format(run))
+    common = (columns, hasTotals, antithetic, outDir, dbase)
+
+    def tasks():
+        done = set()
+        for fullvarid, rows in groupby(q, key=lambda r: r[0]):
+            scenarios = []
+            for (runName, scenario), srows in groupby(rows, key=lambda r: (r[1], r[2])):
+                srows = list(srows)
+                if ranges is None:
+                    years = (min(r[6] for r in srows), max(r[7] for r in srows))
+                else:
+                    years = ranges[(fullvarid, runName, scenario)]
+                label = scenario if runName is None else "{}/{}".format(runName, scenario)
+                iSim, demoid, value = zip(*[r[3:6] for r in srows])
+                scenarios.append((label, years, np.array(iSim), position[np.array(demoid)],
+                                  np.array(value, dtype=float)))
+            done.add(fullvarid)
+            yield (fullvars[fullvarid], scenarios) + common
+        # variables without data get a file with just the title, as from the GUI
+        for fullvarid in fullvars:
+            if fullvarid not in done:
+                yield (fullvars[fullvarid], []) + common
+
+    fullvars = {fullvarid: (name, subCat) for fullvarid, name, subCat in names}
+    n = 0
+    if jobs == 1:
+        for task in tasks():
+            print(writeReport(task))
+            n += 1
+    else:
+        # tasks are read here, since the connection belongs to this thread, and only a few
+        # are queued at a time so the whole database is never in memory
+        jobs = jobs or multiprocessing.cpu_count()
+        pool = multiprocessing.Pool(jobs)
+        pending = deque()
+        try:
+            for task in tasks():
+                pending.append(pool.apply_async(writeReport, (task, )))
+                if len(pending) >= 2*jobs:
+                    print(pending.popleft().get())
+                    n += 1
+            while pending:
+                print(pending.popleft().get())
+                n += 1
+        finally:
+            pool.close()
+            pool.join()
+    conn.close()
+    return n
+
+def writeReport(task):
+    """Write one report; runs in the worker processes.
+    task is ((var, subcat), scenarios, columns, hasTotals, antithetic, outDir, inName), with scenarios a list of
+    (label, (first year, last year), iSim, column, value) and the last 3 arrays giving each sum over years.
+    Return the file name."""
+    (var, subcat), scenarios, columns, hasTotals, antithetic, outDir, inName = task
+    fout = openReport(outDir, var, subcat, inName)
+    for label, years, iSim, column, value in scenarios:
+        fout.write("Totals for {}-{}.\n".format(*years))
+        df, sims = pivot(label, iSim, column, value, columns, hasTotals)
+        writeFrame(fout, addStats(df, sims, antithetic))
+    fout.close()
+    return fout.name
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+    n = reportAll(args.database, args.outDir, args.jobs, args.antithetic)
+    print("Wrote {} reports to {}".format(n, args.outDir))
+
+if __name__ == "__main__":
+    main()
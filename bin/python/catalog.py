@@ -0,0 +1,185 @@
+# Combine the databases of several runs, as made by frmtToData.py, without copying them
+# File: catalog.py
+#
+# A catalog is a small SQLite database listing run names and the databases holding their results,
+# e.g., allData.db files built from the .frmt files kept in MC/saved_runs/<name>.
+# attachStatements() gives the SQL that ATTACHes each run database to a connection to the catalog
+# and defines TEMP tables and views with the names frmtToData.py uses:
+#    variable, fullvar   the variables and subcategories found in any run, with catalog wide ids
+#    demo                as in each run
+#    data                the data of every run, with an extra first column run and fullvarid mapped
+#                        to the catalog's
+#    yeartotal           likewise, if every run has it
+# so comparing runs is a query against data, e.g., GROUP BY run, scenario.  frmtReport.py accepts a
+# catalog as its input file.
+#
+# SQLite allows at most 10 attached databases unless compiled otherwise, so that is the limit on the
+# number of runs a catalog can combine.
+#
+# Usage:
+#    catalog.py add NAME PATH      register PATH, a database or a directory with allData.db, as run NAME
+#    catalog.py remove NAME
+#    catalog.py list
+#    catalog.py query SQL          run SQL with the runs attached and print the results
+# --catalog FILE selects the catalog [default catalog.db].
+
+import argparse
+import os.path
+import sqlite3
+
+parser = argparse.ArgumentParser(description="Combine frmtToData.py databases of several runs")
+parser.add_argument("--catalog", default="catalog.db", help="catalog database [default %(default)s]")
+subparsers = parser.add_subparsers(dest="command")
+p = subparsers.add_parser("add", help="register a run database")
+p.add_argument("name", help="name of the run, as it will appear in the run column")
+p.add_argument("path", help="database made by frmtToData.py, or a directory containing allData.db")
+p = subparsers.add_parser("remove", help="forget a run")
+p.add_argument("name")
+subparsers.add_parser("list", help="show the runs")
+p = subparsers.add_parser("query", help="run an SQL query across all runs")
+p.add_argument("sql")
+
+DEFAULT_DB = "allData.db"
+
+
+class CatalogError(Exception):
+    pass
+
+
+def isCatalog(dbase):
+    "Return True if the file dbase is a catalog"
+    conn = sqlite3.connect(dbase)
+    try:
+        return bool(conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='run';").fetchone())
+    finally:
+        conn.close()
+
+
+class Catalog:
+    "The runs registered in a catalog database"
+    def __init__(self, dbase):
+        self._conn = sqlite3.connect(dbase)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS run (name text primary key, path text);")
+
+    def runs(self):
+        "Return list of (name, path) in the order added"
+        return self._conn.execute("SELECT name, path FROM run ORDER BY rowid;").fetchall()
+
+    def add(self, name, path):
+        if os.path.isdir(path):
+            path = os.path.join(path, DEFAULT_DB)
+        path = os.path.abspath(path)
+        if not os.path.isfile(path):
+            raise CatalogError("No database {}".format(path))
+        conn = sqlite3.connect(path)
+        try:
+            if not conn.execute("SELECT name FROM sqlite_master WHERE name='data';").fetchone():
+                raise CatalogError("{} was not made by frmtToData.py".format(path))
+        finally:
+            conn.close()
+        with self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO run VALUES (?, ?);", (name, path))
+
+    def remove(self, name):
+        with self._conn:
+            if not self._conn.execute("DELETE FROM run WHERE name=?;", (name, )).rowcount:
+                raise CatalogError("No run {}".format(name))
+
+    def close(self):
+        self._conn.close()
+
+
+def _literal(text):
+    "Return text quoted for SQL"
+    return "'{}'".format(text.replace("'", "''"))
+
+
+def attachStatements(dbase):
+    """Return list of SQL statements to run on a connection to the catalog dbase so that it
+    presents the combined runs"""
+    cat = Catalog(dbase)
+    try:
+        runs = cat.runs()
+    finally:
+        cat.close()
+    if not runs:
+        raise CatalogError("No runs in {}".format(dbase))
+    sql = ["CREATE TEMP TABLE variable (varid integer primary key, name text unique, description text);",
+           "CREATE TEMP TABLE fullvar (fullvarid integer primary key, varid integer, subCat text, "
+           "UNIQUE (varid, subCat));",
+           "CREATE TEMP TABLE fullvarmap (run text, localid integer, fullvarid integer, "
+           "PRIMARY KEY (run, localid));"]
+    # ATTACH first: it is not allowed inside the transaction the INSERTs may open
+    attaches = []
+    selects = []
+    totals = []
+    for i, (name, path) in enumerate(runs, 1):
+        schema = "run{}".format(i)
+        run = _literal(name)
+        attaches.append("ATTACH DATABASE {} AS {};".format(_literal(path), schema))
+        sql += ["INSERT OR IGNORE INTO temp.variable (name) SELECT name FROM {}.variable ORDER BY varid;".format(schema),
+                "INSERT OR IGNORE INTO temp.fullvar (varid, subCat) SELECT tv.varid, f.subCat FROM {0}.fullvar f "
+                "JOIN {0}.variable v USING (varid) JOIN temp.variable tv ON tv.name = v.name "
+                "ORDER BY f.fullvarid;".format(schema),
+                "INSERT INTO temp.fullvarmap SELECT {1}, f.fullvarid, tf.fullvarid FROM {0}.fullvar f "
+                "JOIN {0}.variable v USING (varid) JOIN temp.variable tv ON tv.name = v.name "
+                "JOIN temp.fullvar tf ON tf.varid = tv.varid AND tf.subCat = f.subCat;".format(schema, run)]
+        selects.append("SELECT {1} AS run, d.scenario, d.iSim, m.fullvarid, d.year, d.demoid, d.value "
+                       "FROM {0}.data d JOIN temp.fullvarmap m ON m.run = {1} AND m.localid = d.fullvarid".format(
+                           schema, run))
+        if totals is not None and _hasYearTotal(path):
+            totals.append("SELECT {1} AS run, t.scenario, t.iSim, m.fullvarid, t.demoid, t.value "
+                          "FROM {0}.yeartotal t JOIN temp.fullvarmap m ON m.run = {1} AND m.localid = t.fullvarid".format(
+                              schema, run))
+        else:
+            totals = None
+    sql += ["CREATE TEMP VIEW demo AS SELECT * FROM run1.demo;",
+            "CREATE TEMP VIEW data AS {};".format(" UNION ALL ".join(selects))]
+    if totals:
+        sql.append("CREATE TEMP VIEW yeartotal AS {};".format(" UNION ALL ".join(totals)))
+    return attaches + sql
+
+
+def _hasYearTotal(path):
+    conn = sqlite3.connect(path)
+    try:
+        return bool(conn.execute("SELECT name FROM sqlite_master WHERE name='yeartotal';").fetchone())
+    finally:
+        conn.close()
+
+
+def attach(conn, dbase):
+    "Make conn, an sqlite3 connection to the catalog dbase, present the combined runs"
+    for statement in attachStatements(dbase):
+        conn.execute(statement)
+
+
+def connect(dbase):
+    "Return an sqlite3 connection to catalog dbase presenting the combined runs"
+    conn = sqlite3.connect(dbase)
+    attach(conn, dbase)
+    return conn
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    try:
+        if args.command == "query":
+            conn = connect(args.catalog)
+            cursor = conn.execute(args.sql)
+            if cursor.description:
+                print("\t".join(d[0] for d in cursor.description))
+            for r in cursor:
+                print("\t".join(str(x) for x in r))
+            conn.close()
+        else:
+            cat = Catalog(args.catalog)
+            if args.command == "add":
+                cat.add(args.name, args.path)
+            elif args.command == "remove":
+                cat.remove(args.name)
+            for name, path in cat.runs():
+                print("{}\t{}".format(name, path))
+            cat.close()
+    except CatalogError as e:
+        parser.exit(1, "Error: {}\n".format(e))
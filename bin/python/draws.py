@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""Binary archive of the input values drawn for each simulation
+
+Written by montecarlo.py, read by plot.py or any other analysis.
+Each source, a dat file or 'inp' for the keys of inp_distribution.txt, has
+	<name>.f8	float64 array with one row per simulation number and one
+				column per varied slot, in C order.  Row i holds simulation i.
+				Rows of simulations not drawn (yet) are NaN.
+	<name>.json	sidecar with the slot labels and the number of rows.
+
+A column is then a strided view of the file, e.g.
+	labels, data = DrawArchive().read('rsk')
+	data[1:, labels.index('line3_col2')]
+"""
+from __future__ import print_function
+import json
+import os.path
+import numpy as np
+
+ARCHIVE_DIR = os.path.join('MC', 'input_variation', 'draws')
+
+
+class DrawArchive(object):
+	"""Directory of memory-mapped draw arrays
+
+	Attr:
+		directory: where the files live
+	"""
+
+	dtype = np.float64
+
+	def __init__(self, directory=ARCHIVE_DIR):
+		self.directory = directory
+
+	def _paths(self, name):
+		base = os.path.join(self.directory, name)
+		return base + '.f8', base + '.json'
+
+	def _read_sidecar(self, name):
+		sidecar = self._paths(name)[1]
+		if not os.path.isfile(sidecar):
+			return None
+		with open(sidecar) as f:
+			return json.load(f)
+
+	def preallocate(self, name, labels, rows):
+		"""Make room for simulations 0 to rows-1 and return the writable memmap.
+
+		Growing an existing archive keeps its contents.
+		"""
+		labels = list(labels)
+		datapath, sidecar = self._paths(name)
+		meta = self._read_sidecar(name)
+		old_rows = 0
+		if meta is not None:
+			if meta['slots'] != labels:
+				raise ValueError('Draw archive {} has different slots; remove {} to start over'.format(
+					name, self.directory))
+			old_rows = meta['rows']
+		if rows > old_rows:
+			if not os.path.isdir(self.directory):
+				os.makedirs(self.directory)
+			# grow geometrically so runs of single simulations stay cheap
+			rows = max(rows, 2 * old_rows)
+			with open(datapath, 'ab') as f:
+				f.write(np.full((rows - old_rows, len(labels)), np.nan, self.dtype).tobytes())
+			with open(sidecar, 'w') as f:
+				json.dump({'slots': labels, 'rows': rows, 'dtype': 'float64'}, f)
+		else:
+			rows = old_rows
+		return np.memmap(datapath, dtype=self.dtype, mode='r+', shape=(rows, len(labels)))
+
+	def write(self, name, labels, first, values):
+		"""Store values for simulations first, first+1, ...
+
+		values has one row per simulation; any other dimensions are flattened
+		in C order to match labels.
+		"""
+		values = np.asarray(values, dtype=self.dtype)
+		values = values.reshape(len(values), -1)
+		data = self.preallocate(name, labels, first + len(values))
+		data[first:first + len(values)] = values
+		data.flush()
+		del data
+
+	def read(self, name):
+		"""Return (labels, read-only memmap) for source name"""
+		meta = self._read_sidecar(name)
+		if meta is None:
+			raise IOError('No draws for {} in {}'.format(name, self.directory))
+		data = np.memmap(self._paths(name)[0], dtype=self.dtype, mode='r',
+						shape=(meta['rows'], len(meta['slots'])))
+		return meta['slots'], data
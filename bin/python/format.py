@@ -2,9 +2,16 @@
 from __future__ import print_function
 
 import argparse
+import collections
+import functools
+import hashlib
+import io
+import json
+import multiprocessing
 import sys
 import os.path
 import re
+import numpy as np
 
 #for debug
 #import os, ptvsd
@@ -14,6 +21,10 @@ import re
 #ptvsd.break_into_debugger()
 
 OUTPUT_EXTENSION = '.frmt'
+PLAN_FILE = os.path.join('MC','inputs','extraction_plan.json')
+CACHE_DIR = os.path.join('MC','cache')
+END_MARKER = 'SUMMED VARIABLES'
+RATIO_RE = re.compile(r'[0-9]*./ \s*[0-9]*')
 
 SECTIONS = [["NEW CHD CASES"],
 			["CVD PREVALENCE - first of year"],
@@ -69,21 +80,223 @@ SECTIONS = [["NEW CHD CASES"],
 def main():
 	args = parse_args()
 
-	outfile = find_outfile(args.filename)
-	formatted_file = open(args.filename + OUTPUT_EXTENSION,'w')
+	if args.write_plan:
+		write_plan(args.write_plan)
+		return
+	plan = read_plan(args.plan)
+	if args.batch:
+		format_directory(args.batch,args.jobs,plan)
+		return
+	if args.filename is None:
+		print('Give the prefix of an .out file, or --batch DIR')
+		sys.exit(1)
+
+	find_outfile(args.filename)
+	if args.database:
+		scenario = db_scenario(args.scenario or args.filename,args.iteration)
+	if args.no_cache:
+		sections = reformat(args.filename,plan)
+	else:
+		sections = reformat_cached(args.filename,plan,refresh=args.iteration == 0)
+	if not args.no_frmt:
+		with open(args.filename + OUTPUT_EXTENSION,'w') as formatted_file:
+			write_sections(sections,formatted_file)
+	if args.database:
+		store_sections(sections,args.database,scenario,args.iteration)
+
+
+def reformat(source,sections=SECTIONS,offsets=None):
+	"""Return list of TrackedSection's, one per entry of sections, for an .out file
+
+	Args:
+		source: CVDOutfile, path of the .out file (with or without the
+			extension), or an open file or buffer, text or binary, with
+			its contents
+		sections: section specifications, as in SECTIONS
+		offsets: Reformatter.offsets from an .out file with the same
+			layout.  The blocks are then read at those lines without
+			searching, and LayoutChanged raised if a title is not where
+			it was.
+	"""
+	if isinstance(source,CVDOutfile):
+		outfile = source
+	elif offsets is not None:
+		outfile = CVDOutfile(source,titles=(),last_line=Reformatter.last_line(offsets))
+	else:
+		outfile = CVDOutfile(source,section_titles(sections))
+	return Reformatter(outfile,offsets=offsets).format_sections(sections)
+
+
+def reformat_cached(source,sections=SECTIONS,refresh=False):
+	"""reformat, with the block offsets cached in CACHE_DIR
+
+	The zero run, or with refresh any .out file, is searched and its
+	offsets saved; files with the same name then use them.  The cache also
+	records the line of the end marker and how often each title occurs
+	before it, so a file with more years, or another occurrence of a
+	title, is searched again and the cache replaced.
+	"""
+	cache_path = offsets_cache_path(source,sections)
+	titles = section_titles(sections)
+	if not refresh and os.path.isfile(cache_path):
+		with open(cache_path,'r') as f:
+			cache = json.load(f)
+		try:
+			offsets = cache['offsets']
+			outfile = CVDOutfile(source,titles=(),last_line=Reformatter.last_line(offsets))
+			if (outfile.end_line == cache['end_line'] and
+					outfile.title_counts(titles) == cache['counts']):
+				return reformat(outfile,sections,offsets)
+		except (KeyError,TypeError,LayoutChanged):
+			pass
+	outfile = CVDOutfile(source,titles)
+	reformatter = Reformatter(outfile)
+	formatted = reformatter.format_sections(sections)
+	if not os.path.isdir(CACHE_DIR):
+		os.makedirs(CACHE_DIR)
+	tmp_path = '{}.{}.tmp'.format(cache_path,os.getpid())
+	with open(tmp_path,'w') as f:
+		json.dump({'offsets':reformatter.offsets,'end_line':outfile.end_line,
+					'counts':outfile.title_counts(titles)},f)
+	os.replace(tmp_path,cache_path)
+	return formatted
+
+
+def offsets_cache_path(source,sections):
+	"""Return path of the offsets cache for .out file source and sections"""
+	name = os.path.basename(os.path.splitext(source)[0] if source.endswith('.out') else source)
+	digest = hashlib.sha256(json.dumps(sections).encode('utf-8')).hexdigest()[:16]
+	return os.path.join(CACHE_DIR,'{}-{}.offsets.json'.format(name,digest))
+
+
+def read_plan(path=None):
+	"""Return the sections, in SECTIONS form, of extraction plan path
+
+	Without a path use PLAN_FILE if it exists, otherwise SECTIONS.
+	A plan is a JSON file like
+		{"sections": [{"title": "NEW CHD CASES"},
+					{"title": "CVD EVENTS", "linesdown": 17},
+					{"title": "Total Pop -- DE + (DH 1-10)",
+					 "sum": ["Total Pop (DE)", "Total Pop (DH 1-10)"]}],
+		 "keep": ["CVD EVENTS"]}
+	"keep", if present, lists the titles of the sections to extract.
+	"""
+	if path is None:
+		if not os.path.isfile(PLAN_FILE):
+			return SECTIONS
+		path = PLAN_FILE
+	with open(path,'r') as f:
+		plan = json.load(f)
+	sections = []
+	for spec in plan['sections']:
+		if 'sum' in spec:
+			sections.append(['+',spec['title']] + spec['sum'])
+		elif spec.get('linesdown'):
+			sections.append([spec['title'],spec['linesdown']])
+		else:
+			sections.append([spec['title']])
+	if 'keep' in plan:
+		titles = [section[1] if section[0] == '+' else section[0] for section in sections]
+		unknown = set(plan['keep']) - set(titles)
+		if unknown:
+			print('Error: {} keeps sections that are not in it: {}'.format(
+				path,', '.join(sorted(unknown))))
+			sys.exit(1)
+		sections = [section for section,title in zip(sections,titles)
+					if title in plan['keep']]
+	return sections
+
+
+def write_plan(path):
+	"""Write the built in sections to path as an extraction plan to edit"""
+	specs = []
+	for section in SECTIONS:
+		if section[0] == '+':
+			specs.append(collections.OrderedDict([('title',section[1]),('sum',section[2:])]))
+		elif len(section) > 1:
+			specs.append(collections.OrderedDict([('title',section[0]),('linesdown',section[1])]))
+		else:
+			specs.append({'title':section[0]})
+	with open(path,'w') as f:
+		json.dump({'sections':specs},f,indent=1)
+
+
+def write_sections(sections,file):
+	"""Write formatted sections to the open file, in .frmt format"""
+	for section in sections:
+		section.print_lines(file)
+
 
-	reformatter = Reformatter(outfile,formatted_file)
+def db_scenario(name,iteration):
+	"""Return the scenario frmtToData.py gives <name>_<iteration>.frmt
 
-	for section_params in SECTIONS:
+	The database then holds the same scenario whether the values come from
+	here or from loading the .frmt file.  Names it cannot read are an error.
+	"""
+	import frmtToData
+	scenario = frmtToData.frmtScenario(name,iteration)
+	if scenario is None:
+		print('Error: frmtToData.py cannot read {}_{}{}; scenario names may not '
+			'contain _'.format(os.path.basename(name),iteration,OUTPUT_EXTENSION))
+		sys.exit(1)
+	return scenario
+
+
+def store_sections(sections,database,scenario,iteration):
+	"""Put the values of formatted sections in the frmtToData.py database
+
+	The rows are the same frmtToData.py would read from the .frmt file
+	<scenario>_<iteration>.frmt, and replace any the simulation already
+	has, e.g. from an earlier attempt; the database is created if need be.
+	"""
+	import frmtToData
+	conn = frmtToData.openDatabase(database)
+	try:
+		writer = frmtToData.SectionWriter(conn.cursor())
+		writer.delete(scenario,iteration)
+		writer.write(scenario,iteration,sections)
+		conn.commit()
+	finally:
+		conn.close()
+
+
+def format_file(path,sections=SECTIONS):
+	"""Reformat the .out file path into the .frmt file beside it; return the latter"""
+	prefix = os.path.splitext(path)[0]
+	with open(prefix + OUTPUT_EXTENSION,'w') as formatted_file:
+		write_sections(reformat(path,sections),formatted_file)
+	return prefix + OUTPUT_EXTENSION
+
+
+def format_directory(directory,jobs=None,sections=SECTIONS):
+	"""Reformat every .out file in directory with a pool of jobs processes"""
+	paths = sorted(os.path.join(directory,name) for name in os.listdir(directory)
+					if name.endswith('.out'))
+	if not paths:
+		print('No .out files in ' + directory)
+		return []
+	pool = multiprocessing.Pool(jobs)
+	try:
+		results = pool.map(functools.partial(format_file,sections=sections),paths,chunksize=1)
+	finally:
+		pool.close()
+		pool.join()
+	print('Reformatted {} .out files in {}'.format(len(results),directory))
+	return results
+
+
+def section_titles(sections):
+	"""Return list of the distinct titles searched for by sections"""
+	titles = []
+	for section_params in sections:
 		if section_params[0] == '+':
-			section = add_sections(reformatter,*section_params[1:])
+			candidates = section_params[2:]
 		else:
-			section = TrackedSection(*section_params)
-			if section_params[0] == "NEW DIABETES CASES":
-				xyzzy = 1
-			reformatter.format(section)
-		
-		section.print_lines(formatted_file)
+			candidates = section_params[:1]
+		for title in candidates:
+			if title not in titles:
+				titles.append(title)
+	return titles
 
 
 def add_sections(reformatter,title,*add_titles):
@@ -103,89 +316,127 @@ def add_sections(reformatter,title,*add_titles):
 
 def parse_args():
 	parser = argparse.ArgumentParser()
-	parser.add_argument('filename',help='prefix of .out file to be reformatted'
+	parser.add_argument('filename',nargs='?',help='prefix of .out file to be reformatted'
 							'e.g. \'base\' if the .out file is \'base.out\'')
+	parser.add_argument('--batch',metavar='DIR',help='reformat every .out file in DIR, '
+							'writing each .frmt file beside its .out file')
+	parser.add_argument('--jobs','-j',type=int,help='number of processes for --batch '
+							'[default: one per CPU]')
+	plan_group = parser.add_argument_group('extraction plan')
+	plan_group.add_argument('--plan',help='JSON file listing the sections to extract '
+							'[default {} if it exists, else all]'.format(PLAN_FILE))
+	plan_group.add_argument('--write-plan',metavar='FILE',help='write the built in list of '
+							'sections to FILE as a plan to edit, and exit')
+	plan_group.add_argument('--no-cache',action='store_true',help='search the .out file for '
+							'every title instead of using the line offsets cached in '
+							'{}'.format(CACHE_DIR))
+	db_group = parser.add_argument_group('database output')
+	db_group.add_argument('--database',help='also append the values to this frmtToData.py '
+							'database, creating it if need be')
+	db_group.add_argument('--scenario',help='scenario to record in the database, '
+							'as frmtToData.py reads it from <scenario>_<iteration>.frmt '
+							'[default: the .out file prefix]')
+	db_group.add_argument('--iteration','-i',type=int,default=0,
+							help='simulation number to record in the database; 0, the '
+							'zero run, also rebuilds the cached offsets [default 0]')
+	db_group.add_argument('--no-frmt',action='store_true',
+							help='do not write the .frmt file; use with --database')
 	return parser.parse_args()
 
 
 def find_outfile(file_prefix):
+	"""Exit unless the .out file of file_prefix exists; reformat reads it"""
 	if not os.path.isfile(file_prefix + '.out'):
 		print('Invalid File Name: ' + file_prefix + '.out')
 		print('If using mc.bat, ensure .out file is made with same prefix as inp file')
 		sys.exit(1)
-	return CVDOutfile(file_prefix)
 
 
 class TrackedSection(object):
 	"""Used to represent group of numeric data blocks denoted by 'title'
 
+	Values are kept as numbers, along with their text as printed in the
+	.out file, which get_lines() writes unchanged.
+
 	Attr:
 		title: String to look for that indicates start of block
 		linesdown: Integer number of lines down to search for block after title
 			--by default (linesdown=0) searches for first number-containing
 			line after the title, but this isn't possible for some groups
 			e.g. "CVD POPULATION DISTRIBUTION BY STATE"
-		lines: List of formatted lines for group
+		header: OutputHeader, None until the first block is read
+		categories: List of the categories of the header, empty until
+			the first block is read
+		rows: List of (year, values) for each data line, values being an
+			<np.array> of 12 values (M then F by age) for each category,
+			NaN where the text is not a number
+		texts: List with the text of each value of each row
 	"""
 
 	def __init__(self, title, linesdown=0):
 		self.title = title
 		self.linesdown = linesdown
 		self.year_offset = 0
-		self.lines = [title]
-		self.num_format = ''
+		self.header = None
+		self.categories = []
+		self.rows = []
+		self.texts = []
+		self.num_nums = 0
 
 	def set_title(self,title):
 		self.title = title
-		self.lines[0] = title
-
-	def append_line(self,str):
-		self.lines.append(str)
 
 	def add_lines(self,group):
-		lines = group.lines
-		for line_num,line in enumerate(lines):
-			split_line = line.split()
-			if str.isdigit(split_line[0][0]):
-				self.add_line(split_line,line_num)
-
-	def add_line(self,line,line_num):
-			nums_to_add = line[1:]
-			nums_self = self.lines[line_num].split()[1:]
-			sums = []
-			for a,b in zip(nums_to_add,nums_self):
-				try:
-					num = int(a)+int(b)
-				except:
-					num = round(float(a)+float(b),2)
-				sums.append(num)
-			sum_line = [line[0]] + sums
-			self.lines[line_num] = self.num_format.format(*sum_line)
-
-	def format_num_line(self,base_year,num_list):
-		format_str = self.num_format
+		"""Add the values of group, year by year, to this section
+
+		Each pair of integers sums to an integer, and anything else to a
+		float rounded to 2 decimals."""
+		for n,(texts,group_texts) in enumerate(zip(self.texts,group.texts)):
+			sums = [_add(a,b) for a,b in zip(group_texts,texts)]
+			self.rows[n] = (self.rows[n][0],np.array(sums,dtype=float))
+			self.texts[n] = [str(x) for x in sums]
+
+	def add_block(self,base_year,values,texts):
+		"""Append the values, and their texts, of the next year's block"""
 		cur_year = base_year + self.year_offset
 		self.year_offset = self.year_offset + 1
-		if len(num_list) != self.num_nums:
-		    num_list = [0] * self.num_nums
-		return format_str.format(cur_year,*num_list)
+		if len(values) != self.num_nums:
+			values = np.zeros(self.num_nums)
+			texts = ['0']*self.num_nums
+		self.rows.append((cur_year,values))
+		self.texts.append(texts)
 
 	def write_header(self,category_line):
-		header = OutputHeader(category_line)
-		formatted_topline = header.get_topline()
-		formatted_categories = header.get_categories()
-		self.num_nums = 12*len(header.categories)
-		self.num_format = '{}     ' + '{:<18} ' * self.num_nums
-		self.append_line(formatted_categories)
-		self.append_line(formatted_topline)
+		self.header = OutputHeader(category_line)
+		self.categories = self.header.categories
+		self.num_nums = 12*len(self.categories)
+
+	def get_lines(self):
+		"""Return list of formatted lines for group"""
+		lines = [self.title]
+		if self.header is not None:
+			lines.append(self.header.get_categories())
+			lines.append(self.header.get_topline())
+		for (year,values),texts in zip(self.rows,self.texts):
+			lines.append(row_format(len(texts)).format(year,*texts))
+		return lines
 
 	def print_lines(self,file):
-		for line in self.lines:
+		for line in self.get_lines():
 			print(line,file=file)
 		file.write('\n')
 
 
 
+_row_formats = {}
+
+def row_format(num_nums):
+	"""Return format string for a year and num_nums values"""
+	if num_nums not in _row_formats:
+		_row_formats[num_nums] = '{}     ' + '{:<18} ' * num_nums
+	return _row_formats[num_nums]
+
+
 class OutputHeader(object):
 	"""Data for header of data associated with section
 
@@ -231,17 +482,45 @@ class OutputHeader(object):
 		return topline_full
 
 
+class LayoutChanged(Exception):
+	"""An .out file does not have the layout of the offsets used for it"""
+
+
 class Reformatter(object):
 	"""Used to build formatted file from .out file
 
 	Attr:
 		formatted_file: File to be written to
 		outfile: CVDOutfile object containing information for .out file
+		offsets: Dict of 'title|linesdown'->list of [title line, first block
+			line] for each block of the section.  Recorded as the blocks are
+			found, or given to read them without searching.
 	"""
 
-	def __init__(self,outfile,formatted_file):
+	def __init__(self,outfile,formatted_file=None,offsets=None):
 		self.formatted_file = formatted_file
 		self.outfile = outfile
+		self._planned = offsets is not None
+		self.offsets = offsets if self._planned else {}
+
+	@staticmethod
+	def last_line(offsets):
+		"""Return number of lines needed to read the blocks at offsets"""
+		return max([start_line for blocks in offsets.values()
+					for line_num,start_line in blocks] +
+					[CVDOutfile.base_year_line]) + NumBlock.rows
+
+	def format_sections(self,sections):
+		"""Return list of TrackedSection's, one per entry of sections"""
+		formatted = []
+		for section_params in sections:
+			if section_params[0] == '+':
+				section = add_sections(self,*section_params[1:])
+			else:
+				section = TrackedSection(*section_params)
+				self.format(section)
+			formatted.append(section)
+		return formatted
 
 	def format(self,section):
 		""" Reformats sections with particular label
@@ -249,23 +528,39 @@ class Reformatter(object):
 		Args:
 			section: TrackedSection object to be formatted
 		"""
-		for line_num in range(self.outfile.num_lines):
-			if self.outfile.lines_list[line_num].find('SUMMED VARIABLES') > -1:
-				break
-			if self.outfile.find_title(line_num,section.title):
-				self._format_block(line_num,section)
-
-	def _format_block(self,line_num,section):
+		key = '{}|{}'.format(section.title,section.linesdown)
+		if self._planned:
+			if key not in self.offsets:
+				raise LayoutChanged(section.title)
+			for line_num,start_line in self.offsets[key]:
+				self._check_block(line_num,start_line,section)
+				self._format_block(start_line,section)
+			return
+		blocks = []
+		for line_num in self.outfile.title_lines(section.title):
+			start_line = self._next_block_line(section,line_num)
+			blocks.append([line_num,start_line])
+			self._format_block(start_line,section)
+		self.offsets[key] = blocks
+
+	def _check_block(self,line_num,start_line,section):
+		"""Raise LayoutChanged unless the title and block are where expected"""
+		if not (0 <= line_num < self.outfile.num_lines and
+				start_line < self.outfile.num_lines and
+				self.outfile.find_title(line_num,section.title) and
+				(section.linesdown != 0 or start_line <= 0 or
+					'age' in self.outfile.get_line(start_line-1))):
+			raise LayoutChanged(section.title)
+
+	def _format_block(self,start_line,section):
 		base_year = self.outfile.base_year
-		start_line = self._next_block_line(section,line_num)
 
 		if section.year_offset == 0:
 			category_line = self.outfile.get_line(start_line-2)
 			section.write_header(category_line)
 
-		num_list = self.outfile.get_block(start_line)
-		formatted_nums = section.format_num_line(base_year,num_list)
-		section.append_line(formatted_nums)
+		block = self.outfile.get_block(start_line)
+		section.add_block(base_year,block.values,block.texts)
 
 	def _next_block_line(self, section, line_num):
 		"""Returns first line of next numeric block to read in"""
@@ -275,40 +570,121 @@ class Reformatter(object):
 class CVDOutfile(object):
 	"""Contains information of .out file
 
+	Made from the prefix or path of the .out file, or from an open file
+	or buffer with its contents, text or binary.
+
+	The file is read in a single pass that also indexes the lines on which
+	each title occurs.  Only the part before the SUMMED VARIABLES marker is
+	used, so reading stops a few lines after it.
+
 	Attr:
 		base_year_line: Integer ine of .outfile to look for base year
 		age_ranges: Integer number of age ranges considered
 		max_lines_after: Integer number of lines to search for block
 			of numbers after finding a title
+		tail_lines: Integer number of lines kept after the end marker,
+			enough for a block found from a title just before it
 		lines_list: List of lines in .out file
 		base_year: Integer first year of simulation
 		num_lines: Integer number of lines in lines_list
+		titles: Dict of title->list of line numbers where it occurs,
+			before the end marker
+		end_line: Integer line of the end marker, num_lines if there is none
+		last_line: Integer number of lines to read at least, if given; then no
+			titles are indexed
 	"""
 	base_year_line = 9
 	max_lines_after = 15
-
-	def __init__(self,filename):
-		self.lines_list = self._get_lines(filename)
+	tail_lines = 64
+
+	def __init__(self,source,titles=None,last_line=None):
+		if titles is None:
+			titles = section_titles(SECTIONS)
+		self.titles = collections.OrderedDict((title,[]) for title in titles)
+		self.last_line = last_line
+		self.end_line = None
+		self.lines_list = self._get_lines(source)
 		self.base_year = int(self.lines_list[self.base_year_line])
 		self.num_lines = len(self.lines_list)
-
-	def _get_lines(self,filename):
-		with open(filename + '.out', 'r') as myfile:
-			return myfile.readlines()
-
-	def _replace_bad_chars(self, start_line):
-		"""Replace characters that mess with reading in file"""
-		for i in range(start_line, start_line + 6):
-			self.lines_list[i] = self.lines_list[i].replace('. ', ' ')
-			self.lines_list[i] = self.lines_list[i].replace('.\n',' ')
-			#for CVD prevalence -- don't want 'x/y' just want rate
-			self.lines_list[i] = re.sub(r'[0-9]*./ \s*[0-9]*',' ',
-												self.lines_list[i])
+		if self.end_line is None:
+			self.end_line = self.num_lines
+		self._blocks = {}
+
+	def _get_lines(self,source):
+		"""Read the lines up to the end marker and index the titles"""
+		if hasattr(source,'read'):
+			if not isinstance(source.read(0),bytes):
+				return self._read_lines(source)
+			text = io.TextIOWrapper(source)
+			try:
+				return self._read_lines(text)
+			finally:
+				# leave the caller's buffer open
+				text.detach()
+		if not source.endswith('.out'):
+			source = source + '.out'
+		with open(source,'r') as myfile:
+			return self._read_lines(myfile)
+
+	def _read_lines(self,myfile):
+		# cheap test for lines that may contain a title
+		candidate = re.compile('|'.join(re.escape(title) for title in
+			sorted(self.titles,key=len,reverse=True)) or '(?!)')
+		lines = []
+		end = None
+		if self.last_line is not None:
+			# only the lines at known offsets are wanted, and where the end is
+			for line in myfile:
+				lines.append(line)
+				if self.end_line is None and END_MARKER in line:
+					self.end_line = len(lines) - 1
+				if self.end_line is not None and len(lines) >= self.last_line:
+					break
+			return lines
+		for line in myfile:
+			lines.append(line)
+			if end is not None:
+				if len(lines) >= end:
+					break
+			elif END_MARKER in line:
+				self.end_line = len(lines) - 1
+				end = len(lines) + self.tail_lines
+			elif candidate.search(line):
+				self._index_line(line,len(lines) - 1)
+		return lines
+
+	def _index_line(self,line,line_num):
+		for title,line_nums in self.titles.items():
+			if title in line and self._is_title(line,title):
+				line_nums.append(line_num)
+
+	def title_lines(self,title):
+		"""Return list of the numbers of the lines with title, before the end marker"""
+		if title not in self.titles:
+			self.titles[title] = [line_num for line_num in range(self.end_line)
+									if self.find_title(line_num,title)]
+		return self.titles[title]
+
+	def title_counts(self,titles):
+		"""Return dict of title->number of times it occurs, in any context,
+		before the end marker"""
+		text = ''.join(self.lines_list[:self.end_line])
+		return {title:text.count(title) for title in titles}
+
+	def _replace_bad_chars(self, lines):
+		"""Return lines without the characters that mess with reading them"""
+		#for CVD prevalence -- don't want 'x/y' just want rate
+		lines = [line.replace('. ',' ').replace('.\n',' ') for line in lines]
+		return [RATIO_RE.sub(' ',line) if '/' in line else line for line in lines]
 
 	def find_title(self, line_num, title):
-		return (self.lines_list[line_num].find(title + '     ') != -1 or
-			self.lines_list[line_num].find(title + '\n') != -1 and
-			self.lines_list[line_num].find('Acute ' + title) == -1)
+		return self._is_title(self.lines_list[line_num], title)
+
+	@staticmethod
+	def _is_title(line, title):
+		return (line.find(title + '     ') != -1 or
+			line.find(title + '\n') != -1 and
+			line.find('Acute ' + title) == -1)
 
 	def next_data_line(self, line_num):
 		"""Find next line containing numbers after line line_num"""
@@ -319,12 +695,16 @@ class CVDOutfile(object):
 		return -1
 
 	def get_block(self, start_line):
-		"""Get list of values in block starting at line start_line"""
-		self._replace_bad_chars(start_line)
-		block_lines = self.lines_list[start_line:start_line+6]
-		block = NumBlock(block_lines)
-		block.reorder_block()
-		return block.get_list()
+		"""Get NumBlock starting at line start_line
+
+		Blocks are parsed once, since several sections may use the same one."""
+		if start_line not in self._blocks:
+			block_lines = self._replace_bad_chars(
+				self.lines_list[start_line:start_line+NumBlock.rows])
+			block = NumBlock(block_lines)
+			block.reorder_block()
+			self._blocks[start_line] = block
+		return self._blocks[start_line]
 
 	def get_line(self,line_num):
 		return self.lines_list[line_num]
@@ -334,7 +714,9 @@ class NumBlock(object):
 	"""Block of values for one year in .out file
 
 	Attr:
-		num_list: List of the values in a data block of .out file
+		values: <np.array> of the values in a data block of .out file,
+			NaN for text that is not a number, e.g. Fortran's *****
+		texts: List of the values as printed in the .out file
 		columns: Number of columns in data block of .out file
 			double the number of categories in data block (for M/F)
 		rows = Number of rows ' ' - corresponds to number of age ranges
@@ -343,26 +725,43 @@ class NumBlock(object):
 
 
 	def __init__(self,lines_list):
-		self.num_list=[]
 		self._parse_block(lines_list)
-		self.columns = len(self.num_list)//self.rows
+		self.columns = len(self.values)//self.rows
 
 	def _parse_block(self,lines):
-		for line in lines:
-			split_line = line.split()
-			#ignore age range
-			self.num_list += [num for num in split_line[1:]]
+		#ignore age range
+		nums = [num for line in lines for num in line.split()[1:]]
+		self.texts = nums
+		try:
+			self.values = np.array(nums,dtype=float)
+		except ValueError:
+			self.values = np.array([_to_float(num) for num in nums])
 
 	def reorder_block(self):
-		"""Puts block in desired order for printing"""
-		reordered = []
-		for i in range(self.columns):
-			for j in range(self.rows):
-				reordered.append(self.num_list[i + self.columns*j])
-		self.num_list = reordered
+		"""Puts block in desired order for printing, column by column"""
+		size = self.rows * self.columns
+		order = np.arange(size).reshape(self.rows,self.columns).T.ravel()
+		self.values = self.values[order]
+		self.texts = [self.texts[i] for i in order.tolist()]
 
 	def get_list(self):
-		return self.num_list
+		return self.values
+
+
+def _to_float(num):
+	try:
+		return float(num)
+	except ValueError:
+		return np.nan
+
+
+def _add(a,b):
+	"""Return the sum of texts a and b: an int if both are, else a float
+	rounded to 2 decimals"""
+	try:
+		return int(a) + int(b)
+	except ValueError:
+		return round(_to_float(a) + _to_float(b),2)
 
 
 if __name__ == '__main__':
@@ -8,6 +8,8 @@
 #    One file with a SQLite database produced by frmtToData.py
 #    By default, allData.db in the current directory, but
 #    user specifiable. MyWidget.inName has the value.
+#    It may instead be a catalog of several such databases made by catalog.py,
+#    in which case the scenarios of each run are reported separately, labelled run/scenario.
 #
 # OUTPUTS
 #   ageranges_VVV_SSS.csv in the format produced by the Fortran program for some variables
@@ -49,16 +51,27 @@
 #
 # If you wish, you can click on other variables to get other reports, or select different input and output
 # files and repeat.
+#
+# WITHOUT THE GUI
+# frmtReport.py --all [--database allData.db] [--outDir .] [--jobs N] [--antithetic]
+# writes the reports of all variables in one pass over the database, using N processes.
+# This does not need PySide2; see ageranges.py.
 
-from datetime import datetime
 import os.path
+import sqlite3
 import sys
-import re
+
+if __name__ == "__main__" and "--all" in sys.argv[1:]:
+    # headless, as a process of its own: where workers are spawned (Windows, macOS) they import
+    # the main program again, and this one needs PySide2
+    import subprocess
+    sys.exit(subprocess.call([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "ageranges.py")]
+                             + sys.argv[1:]))
+
 from PySide2 import QtCore, QtWidgets, QtGui, QtSql
 from PySide2.QtSql import QSqlQuery
-import pandas as pd
-import numpy as np
-from socket import getfqdn
+import catalog
+import ageranges
 
 class MyErr (Exception):
     pass
@@ -92,15 +105,31 @@ class MyWidget(QtWidgets.QWidget):
         if hasattr(self, "db"):
             self.db.close()
             del self.db
+            self.conn.close()
         self.db = QtSql.QSqlDatabase.addDatabase("QSQLITE")
         self.db.setDatabaseName(self.inName)
         success =  self.db.open()
         if success:
+            self.isCatalog = catalog.isCatalog(self.inName)
+            if self.isCatalog:
+                self._attachRuns()
+            # the reports read straight into NumPy through a second, sqlite3, connection
+            # catalog.attachStatements gives it the same catalog wide ids as the Qt one
+            self.conn = catalog.connect(self.inName) if self.isCatalog else sqlite3.connect(self.inName)
+            # sums over years made by frmtToData.py, in databases new enough to have them
+            self.hasTotals = QSqlQuery().exec_("SELECT 1 FROM yeartotal LIMIT 1;")
             self._linkVariables()
         else:
             del self.db
         return success
 
+    def _attachRuns(self):
+        "make the catalog's runs appear as one database, with a run column in data"
+        for statement in catalog.attachStatements(self.inName):
+            q = QSqlQuery()
+            if not q.exec_(statement):
+                raise MyErr("Unable to open the runs of {}: {}".format(self.inName, q.lastError().text()))
+
     def _initPaths(self):
         "GUI to set input and output paths"
         group = QtWidgets.QGroupBox()
@@ -112,6 +141,10 @@ class MyWidget(QtWidgets.QWidget):
         self.vInName.clicked.connect(self.inNameClicked)
         innerLayout.addWidget(self.vOutDir)
         self.vOutDir.clicked.connect(self.outDirClicked)
+        self.vAntithetic = QtWidgets.QCheckBox("Antithetic pairs")
+        self.vAntithetic.setToolTip("Simulations 2k-1 and 2k were drawn as antithetic pairs (montecarlo.py --antithetic).\n"
+                                    "Adds the pair mean and its standard error to the statistics.")
+        innerLayout.addWidget(self.vAntithetic)
         self.layout.addWidget(group)
         self.inName = "allData.db"
         self.outDir = "."
@@ -183,116 +216,36 @@ class MyWidget(QtWidgets.QWidget):
         Each gets a separate subtable.
         """
         f = self._openFile(var, subcat)
-        q = QSqlQuery(("SELECT scenario, min(year) AS y0, max(year) AS y1 FROM data WHERE fullvarid = {}" +\
-            " GROUP BY scenario ORDER BY scenario;").format(fullvarid))
+        if self.isCatalog:
+            q = QSqlQuery(("SELECT scenario, min(year) AS y0, max(year) AS y1, run FROM data WHERE fullvarid = {}" +\
+                " GROUP BY run, scenario ORDER BY run, scenario;").format(fullvarid))
+        else:
+            q = QSqlQuery(("SELECT scenario, min(year) AS y0, max(year) AS y1 FROM data WHERE fullvarid = {}" +\
+                " GROUP BY scenario ORDER BY scenario;").format(fullvarid))
         while q.next():
             f.write("Totals for {}-{}.\n".format(q.value(1), q.value(2)))
-            self._doScenario(f, fullvarid, q.value(0))
+            self._doScenario(f, fullvarid, q.value(0), q.value(3) if self.isCatalog else None)
         f.close()
         print("Done with {}: {}".format(var, subcat))
 
     def _openFile(self, var, subcat):
         "open an appropriately named file for var/subcat"
-        if subcat == "-":
-            name = var
-        else:
-            name = "{}_{}".format(var, subcat)
-        name = re.sub("/", " or ", name)
-        fname = "ageranges_{}.csv".format(name)
-        fout = open(os.path.join(self.outDir, fname), "wt")
-        if subcat == "-":
-            fout.write(var)
-        else:
-            fout.write("{}: {}".format(var, subcat))
-        fout.write(" Summary created by frmReport.py run at {} on {}. {} -> {}.\n".format(datetime.now(), 
-                        getfqdn(), self.inName,  fname))
-        return fout
-
-    def _doScenario(self, fout, fullvarid, scenario):
-        "Output appropriately rotated results for one scenario"
-        QSqlQuery("DROP VIEW IF EXISTS allyrs;")
-        groupVars = ["iSim", "label"]
-        sqlGroups = ", ".join(groupVars)
-        # parameters not allowed in views
-        strSQL = "SELECT "+sqlGroups+", TOTAL(value) as v" +\
-            " FROM data LEFT OUTER JOIN demo USING (demoid) " +\
-            " WHERE fullvarid = {} AND scenario = '{}' GROUP BY ".format(fullvarid, scenario) +\
-            sqlGroups +" ORDER BY "+ sqlGroups + ";"
-        q = QSqlQuery()
-        q.prepare("CREATE TEMP VIEW allyrs AS " + strSQL)
-        if not q.exec_():
-            raise MyErr("Unable to create temp allyrs: "+q.lastError().text())
-        q2 = QSqlQuery()
-        if not q2.exec_("SELECT DISTINCT label FROM allyrs ORDER BY label;"):
-            raise MyErr("Unable to count demographics from temp allyrs: "+q2.lastError().text())
-        # q.size seems to always be -1
-        labels = []
-        while q2.next():
-            labels.append(q2.value(0))
-        nDemo = len(labels)
+        return ageranges.openReport(self.outDir, var, subcat, self.inName)
 
-        q = QSqlQuery()
-        q.setForwardOnly(True)
-        if not q.exec_("SELECT * FROM allyrs;"):
-            print(q.lastError())
-            return
-        # at this point we have v with totals across years
-        colNames = ["file"] + labels
-        self.df = pd.DataFrame(self._chunk(q, scenario, labels), columns=colNames)
-        self._addTotals()
+    def _doScenario(self, fout, fullvarid, scenario, run=None):
+        """Output appropriately rotated results for one scenario
+        run is the name of the run in a catalog, None for a plain database"""
+        # one query, straight into a float array of iSim x demo
+        self.df, self.sims = ageranges.scenarioFrame(self.conn, fullvarid, scenario, run, self.hasTotals)
         self._addStats()
-        # this option worked with to_string, but with to_csv it yields
-        # TypeError: only size-1 arrays can be converted to Python scalars
-        # float_format=(lambda a : np.format_float_positional(a, precision=2))
-        self.df.to_csv(fout, line_terminator="\n")
+        ageranges.writeFrame(fout, self.df)
         return self.df
 
-    def _chunk(self, q, scenario, labels):
-        """Rotate entries for one chunk and return a DataFrame.
-        q is a query result with the necessary data, only for one fullvarid/scenario
-        labels are the column labels
-        a chunk is one particular variable, subCat, and scenario"""
-        iSim = -1
-        last_label = labels[len(labels)-1]
-        while q.next():
-            if iSim < 0:
-                # start of this row
-                t_row = [ scenario ]
-            iSim = q.value(0)
-            t_row.append(q.value(2))
-            if q.value(1) == last_label:
-                # one transposed row is ready
-                yield t_row
-                iSim = -1
-
-    def _addTotals(self) :
-          """add columns with totals for both sexes and overall.
-          The self.df is modified in place """
-          self._addMF('F')
-          self._addMF('M')
-          self._addAll()
-
-    def _addMF(self, sex):
-        cnms = self.df.columns
-        idx = [i for i in range(len(cnms)) if (cnms[i].startswith(sex) and cnms[i][1].isdigit())]
-        self.df.insert(self.df.shape[1], sex+" (all)", self.df.iloc[:, idx].sum(axis=1))
-
-    def _addAll(self):
-        ncol = self.df.shape[1]
-        # iloc arguments must be [] not ()
-        self.df.insert(ncol, "Everyone", self.df.iloc[:, [ncol-2, ncol-1]].sum(axis=1))
-
-
     def _addStats(self):
         """Compute requested statistics for self.df
         and insert them at the top of same"""
-        # for now ignore requested stats and just give all
-        # the dtype of most columns, even the numbers, is object
-        # so filtering based on dtype won't work
-        aSumDF = self.df.iloc[:, 1:].describe(percentiles=(0.05, .10, .25, .5, .75, .9, .95))
-        aSumDF.insert(0, "file", self.df.iloc[0, 0])
-        self.df = pd.concat([aSumDF, self.df])
-     
+        self.df = ageranges.addStats(self.df, self.sims, self.vAntithetic.isChecked())
+
 if __name__ == "__main__":
     app = QtWidgets.QApplication([])
     screenSize = app.primaryScreen().availableSize()
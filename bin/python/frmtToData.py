@@ -4,11 +4,18 @@
 # Created: 2019-09-12
 
 import argparse
+import functools
 import glob
+import hashlib
+import json
+from itertools import repeat
+import multiprocessing
+from operator import add
 import os.path
 from pathlib import Path
 import re
 import sqlite3
+import time
 from datetime import datetime
 now = datetime.now
 
@@ -53,9 +60,32 @@ All appropriate .frmt files will be scanned.
 You may instead specify a top-level project directory and the program will look for %(default)s below it if no .frmt
 files are in the top directory.""")
 
-parser.add_argument("--database", default="allData.db", help="""name of database file to create [default %(default)s].
+parser.add_argument("--database", default="allData.db", help="""name of database file to create or update [default %(default)s].
 Include directories to place it in a particular directory.
-Any previous file of this name will be deleted.""")
+Only .frmt files that are new or changed since the last load are read into an existing database.""")
+
+parser.add_argument("--rebuild", action="store_true", help="""delete any previous database and load every file.""")
+
+parser.add_argument("--wide", action="store_true", help="""store one row per scenario, simulation, variable and year,
+with the 12 demographic values as columns, in table yeardata.  A view named data presents it as the usual
+one row per value.  The file is several times smaller.""")
+
+parser.add_argument("--stats", metavar="FILE", help="""where to write the JSON summary of the load: files, lines,
+rows and bytes read, time spent parsing and in SQLite, and rates [default: database name with _ingest.json
+in place of the extension]""")
+
+parser.add_argument("--cube", metavar="DIR", help="""also write the results as a dense memory-mapped array
+to DIR, for results.open(DIR); see results.py.""")
+
+parser.add_argument("--watch", action="store_true", help="""after loading, keep watching the directory and load each
+new .frmt file as it lands, e.g., while mc run is going.  Stop with Ctrl-C.""")
+
+parser.add_argument("--interval", type=float, default=2.0, help="""seconds between looks at the directory with --watch [default %(default)s]""")
+
+parser.add_argument("--idle", type=float, default=None, help="""with --watch, stop once no new file has arrived for this many seconds""")
+
+parser.add_argument("--jobs", type=int, default=None, help="""number of processes parsing .frmt files [default: one per CPU].
+A single process writes the database.  1 parses in the writing process.""")
 
 
 ## main classes
@@ -64,59 +94,258 @@ class WeirdFName(Exception):
         self.fname = fname
 
 class FrmtDir:
-    "represent a directory with .frmt files"
-    def __init__(self, dir, dbase, top, notifyInterval=100):
+    """represent a directory with .frmt files and the database they are loaded into
+    The ingest table records every file loaded, so a later FrmtDir only loads files that are new or changed."""
+    def __init__(self, dir, dbase, top, notifyInterval=100, jobs=None, rebuild=False, wide=False):
         """dir is a path like object
-        dbase is the name of the database backend"""
+        dbase is the name of the database backend
+        jobs is the number of processes parsing files, None for one per CPU
+        rebuild deletes any existing database first
+        wide selects the schema with one row per year, see makeTable"""
         pathDB = Path(dbase)
-        if pathDB.exists():
+        if pathDB.exists() and not rebuild and not loadFinished(dbase):
+            print("{} was not completely loaded; rebuilding it.".format(dbase))
+            rebuild = True
+        if pathDB.exists() and not rebuild and not hasTables(dbase, ("ingest", "yeartotal")):
+            print("{} was built by an older frmtToData.py; rebuilding it.".format(dbase))
+            rebuild = True
+        if pathDB.exists() and not rebuild and isWide(dbase) != wide:
+            print("{} has the {} schema; rebuilding it.".format(dbase, "wide" if not wide else "long"))
+            rebuild = True
+        if pathDB.exists() and rebuild:
             pathDB.unlink()
         self._dir = Path(dir)
         assert self._dir.is_dir()
-        files = self._dir.glob("*.frmt")
+        self._notifyInterval = notifyInterval
+        self.stats = IngestStats()
+        self._top = top
+        self._jobs = jobs
+        self._skipped = set()
+        fresh = not pathDB.exists()
+        self._open(dbase, fresh, wide)
+        if not fresh:
+            # reloading most files one by one is slower than starting again, e.g. after a new mc run
+            reloads = sum(file.name in self._manifest for file in self.pending())
+            if 2*reloads > len(self._manifest):
+                print("{} of the {} files in {} have changed; rebuilding it.".format(reloads, len(self._manifest), dbase))
+                self._conn.close()
+                pathDB.unlink()
+                self._open(dbase, True, wide)
+        self.update()
+        if self._fresh:
+            # from now on a failure must not lose what is loaded
+            self._conn.execute("PRAGMA user_version = 0;")
+            self._conn.commit()
+            bulkPragmas(self._conn, fresh=False)
+            self._fresh = False
+
+    def _open(self, dbase, fresh, wide):
         self._conn = sqlite3.connect(dbase)
+        bulkPragmas(self._conn, fresh)
         self._c = self._conn.cursor()
-        makeTable(self._c)
-        self._vs = Variables(self._c)
-        self._fvs = FullVars(self._c)
-        self._notifyInterval = notifyInterval
-        self._scan(files, top)
+        self._fresh = fresh
+        if fresh:
+            makeTable(self._c, wide)
+            # cleared once the first load commits; see bulkPragmas
+            self._c.execute("PRAGMA user_version = {};".format(LOADING))
+            self._conn.commit()
+        self._writer = DataWriter(self._c)
+        self._vs = self._writer._vs
+        self._fvs = self._writer._fullvs
+        self._manifest = Manifest(self._c)
+
+    def update(self, files=None):
+        """Load files, by default all new or changed .frmt files after removing those no longer there,
+        and commit.  Return the number of files loaded."""
+        if files is None:
+            self.prune()
+            files = self.pending()
+        n = self._scan(files, self._top, self._jobs)
+        t0 = time.perf_counter()
         self._conn.commit()
+        self.stats.sqlSeconds += time.perf_counter() - t0
+        return n
+
+    def pending(self):
+        "Return the .frmt files of the directory not yet loaded in their current state"
+        files = []
+        for file in self._dir.glob("*.frmt"):
+            base = file.name
+            if not FrmtFile.fnameRE.match(base):
+                if base not in self._skipped:
+                    print("Skipping {} (non-conformant name)".format(base))
+                    self._skipped.add(base)
+            elif self._manifest.changed(file):
+                files.append(file)
+        return files
+
+    def prune(self):
+        "Remove the rows of files loaded earlier that are no longer in the directory; return their number"
+        present = {file.name for file in self._dir.glob("*.frmt")}
+        gone = [name for name in self._manifest if name not in present]
+        for name in gone:
+            print("Removing {} (no longer in {})".format(name, self._dir))
+            m = FrmtFile.fnameRE.match(name)
+            self._writer.delete(m.group(1), int(m.group(2)))
+            self._manifest.remove(name)
+        return len(gone)
 
-    def _scan(self, files, top):
+    def watch(self, interval=2.0, idle=None):
+        """Load .frmt files as they arrive until interrupted, or until none arrived for idle seconds.
+        A file is loaded once its size and time stamp are the same on two looks interval seconds apart,
+        so files still being copied are left for later."""
+        print("Watching {} for new files.".format(self._dir))
+        last = {}
+        tlast = time.monotonic()
+        try:
+            while idle is None or time.monotonic() - tlast < idle:
+                time.sleep(interval)
+                seen = {file: _stamp(file) for file in self.pending()}
+                ready = [file for file, stamp in seen.items() if last.get(file) == stamp]
+                last = seen
+                if ready:
+                    self.update(sorted(ready))
+                    for file in ready:
+                        del last[file]
+                if seen:
+                    tlast = time.monotonic()
+        except KeyboardInterrupt:
+            self._conn.commit()
+            print("Stopped watching.")
+
+    def _scan(self, files, top, jobs):
         tstart = now()
         print("Starting scan at {}".format(tstart))
         nfiles = 0
-        for file in files:
-            try:
-                ff = FrmtFile(file, self._vs, self._fvs, self._c)
-                ff.examine(top=top, notifyInterval=self._notifyInterval)
-                nfiles += 1
-            except WeirdFName as wf:
-                print("Skipping {} (non-conformant name)".format(wf.fname))
+        stats = self.stats
+        for file, parsed in self._parseAll(files, top, jobs):
+            ff = parsed
+            name = os.path.basename(str(file))
+            t0 = time.perf_counter()
+            if self._manifest.known(name, ff.hash):
+                # touched but not changed
+                self._manifest.record(name, ff)
+                stats.sqlSeconds += time.perf_counter() - t0
+                continue
+            if name in self._manifest:
+                print("Reloading changed {}".format(name))
+                self._writer.delete(ff.stem, ff.iSim)
+            elif not self._fresh:
+                # format.py --database may have stored the simulation without an ingest entry
+                self._writer.delete(ff.stem, ff.iSim)
+            rows = self._writer.write(ff.stem, ff.iSim, ff.sections)
+            self._manifest.record(name, ff)
+            stats.add(ff, rows, time.perf_counter() - t0)
+            nfiles += 1
+            if self._notifyInterval and stats.files % self._notifyInterval == 0:
+                print(stats.report())
         tend = now()
-        print("Finished {} files at {} after {} seconds.".format(nfiles, tend, (tend-tend).total_seconds()))
-            
+        print("Finished {} files at {} after {} seconds.".format(nfiles, tend, (tend-tstart).total_seconds()))
+        print(stats.report())
+        return nfiles
+
+    def _parseAll(self, files, top, jobs):
+        """Yield (file, <FrmtFile>) for each file, parsed by a pool of jobs processes.
+        Files come back in order, so ids are assigned as by a serial scan."""
+        parse = functools.partial(parseFrmtFile, top=top)
+        if jobs == 1 or len(files) < 2:
+            for file in files:
+                yield file, parse(file)
+            return
+        pool = multiprocessing.Pool(jobs)
+        try:
+            for file, ff in zip(files, pool.imap(parse, files, chunksize=4)):
+                yield file, ff
+        finally:
+            pool.close()
+            pool.join()
+
+class IngestStats:
+    """Counters for the files loaded by a FrmtDir, kept as they go rather than by querying the database.
+    Parse time is the sum over the parsing processes, so with --jobs above 1 it may exceed the elapsed time.
+    SQLite time is everything the writing process does with a parsed file, including building the rows."""
+    def __init__(self):
+        self.files = self.lines = self.rows = self.bytes = 0
+        self.parseSeconds = self.sqlSeconds = 0.0
+        self._start = time.perf_counter()
+
+    def add(self, ff, rows, sqlSeconds):
+        "Count <FrmtFile> ff, which went into rows database rows in sqlSeconds"
+        self.files += 1
+        self.lines += ff.lines
+        self.rows += rows
+        self.bytes += ff.size
+        self.parseSeconds += ff.parseSeconds
+        self.sqlSeconds += sqlSeconds
+
+    def summary(self):
+        "Return dict of the counters and rates"
+        elapsed = time.perf_counter() - self._start
+        return {"files": self.files, "lines": self.lines, "rows": self.rows, "bytes": self.bytes,
+                "elapsedSeconds": round(elapsed, 3), "parseSeconds": round(self.parseSeconds, 3),
+                "sqlSeconds": round(self.sqlSeconds, 3),
+                "rowsPerSecond": round(self.rows/elapsed, 1) if elapsed else None,
+                "bytesPerSecond": round(self.bytes/elapsed, 1) if elapsed else None}
+
+    def report(self):
+        "Return a one line progress report"
+        s = self.summary()
+        return ("{files} files, {lines} lines, {rows} rows in {elapsedSeconds} s (parse {parseSeconds} s, "
+                "SQLite {sqlSeconds} s): {rowsPerSecond} rows/s, {bytesPerSecond} bytes/s at {now}").format(
+                    now=now(), **s)
+
+    def write(self, fname):
+        "Write the summary to fname as JSON"
+        with open(fname, "wt") as fout:
+            json.dump(self.summary(), fout, indent=1)
+
+def _stamp(file):
+    "Return (size, mtime) of file"
+    st = os.stat(str(file))
+    return st.st_size, st.st_mtime
+
+def frmtScenario(name, iSim):
+    """Return the scenario recorded for the .frmt file of name, an .out file prefix or scenario, and iSim
+    None if <name>_<iSim>.frmt is not a name FrmtFile reads"""
+    m = FrmtFile.fnameRE.fullmatch("{}_{}.frmt".format(os.path.basename(name), iSim))
+    return m.group(1) if m else None
+
+def parseFrmtFile(fn, top=None):
+    "Return <FrmtFile> for fn, parsed and fingerprinted; runs in the worker processes"
+    t0 = time.perf_counter()
+    ff = FrmtFile(fn)
+    ff.fingerprint()
+    ff.examine(top=top)
+    ff.parseSeconds = time.perf_counter() - t0
+    return ff
+
 class FrmtFile:
-    "parse a format file and put results in database"
+    """parse a format file
+    After examine() sections holds (varname, chunks) for each variable in the file,
+    chunks being a list of (subvar, year, values) with 12 values, one per demographic group.
+    subvar is None for the primary outcome."""
     fnameRE = re.compile(r"([^_]+)_(\d+)\.frmt")
 
-    def __init__(self, fn, vs, fullvs, cursor):
-        """fn <str|path> the file to parse
-        vs <Variables> table of variables
-        fullvs <FullVars> table of variable, subcategory
-        cursor  cursor for the database"""
+    def __init__(self, fn):
+        """fn <str|path> the file to parse"""
         self._fn = str(fn)
         # Python 3.5.2 basename is allergic with WindowsPath objects
         base = os.path.basename(self._fn)
         m = FrmtFile.fnameRE.match(base)
         if not m:
             raise WeirdFName(base)
-        self._stem = m.group(1)
+        self.stem = m.group(1)
         self.iSim = int(m.group(2))
-        self._c = cursor
-        self._vs = vs
-        self._fullvs = fullvs
+        self.sections = []
+        self.size = self.mtime = self.hash = None
+        self.lines = 0
+        self.parseSeconds = 0.0
+
+    def fingerprint(self):
+        "Record size, mtime and hash of the file's contents, as kept in the ingest table"
+        self.size, self.mtime = _stamp(self._fn)
+        with open(self._fn, "rb") as fin:
+            self.hash = hashlib.sha1(fin.read()).hexdigest()
 
 
     def header2(self, line):
@@ -124,6 +353,8 @@ class FrmtFile:
         Return None if not, else a list of (position, header)"""
         if len(line)<100:
             return None
+        # trailing blanks can't start a header, and make h2RE backtrack for a long time
+        line = line.rstrip()
         iPos = 0
         r = []
         while True:
@@ -140,11 +371,7 @@ class FrmtFile:
         else:
             return None
     
-    def examine(self, top=100, notifyInterval=100):
-        if notifyInterval and self.iSim % notifyInterval == 0:
-            self._c.execute("SELECT count(*) as n FROM data;")
-            r = self._c.fetchone()[0]
-            print("iSim {}, data rows {} at {}".format(self.iSim, r, now()))
+    def examine(self, top=100):
         i = 0
         state = 0  # scan for variable name
         with open(self._fn, "rt") as fin:
@@ -154,7 +381,8 @@ class FrmtFile:
                 i += 1
                 if state == 0:
                     varname = line.strip()
-                    varid = self._vs.id(varname)
+                    chunks = []
+                    self.sections.append( (varname, chunks) )
                     state = 1
                 elif state == 1:
                     #sub heads
@@ -192,94 +420,365 @@ class FrmtFile:
                         # presumed end of subtable
                         state = 0
                         continue
-                    year = line[:4]
+                    year = _number(line[:4], int)
                     if subVars:
                         iOld = 0
                         oldSub = None
                         for iStart, subvar in subVars:
                             if iOld:
-                                self.acceptData(varid, oldSub, year, line[iOld:iStart] )
+                                self.acceptData(chunks, oldSub, year, line[iOld:iStart] )
                             iOld = iStart
                             oldSub = subvar
                         # fall through to get last group
                     else:
                         iOld = 9
                         oldSub = None
-                    self.acceptData(varid, oldSub, year, line[iOld:] )
+                    self.acceptData(chunks, oldSub, year, line[iOld:] )
+        self.lines = i
 
-    def acceptData(self, varid, subvar, year, text):
+    def acceptData(self, chunks, subvar, year, text):
         "Process and record one chunk of data relating to a single subvar"
         if subvar == "TBD":
             # these seem to have no useful info are duplicated
             return
-        fullVarid = self._fullvs.id(varid, subvar)
-        xs = text.split()
-        demoid = 1
-        for x in xs:
-            self._c.execute("INSERT INTO data VALUES (?, ?, ?, ?, ?, ?);",
-                            (self._stem, self.iSim, fullVarid, year, demoid, x))
-            demoid += 1
-
-def makeTable(d):
-    "Create database tables in d, a cursor"
+        fields = text.split()
+        try:
+            values = [float(x) for x in fields]
+        except ValueError:
+            values = [_number(x, float) for x in fields]
+        chunks.append( (subvar, year, values) )
+
+def _number(text, kind):
+    """Return text converted by kind, or text itself if that fails.
+    SQLite would store such text as is."""
+    try:
+        return kind(text)
+    except ValueError:
+        return text
+
+class DataWriter:
+    """Write parsed results to the data table, or yeardata for the wide schema,
+    assigning ids from in-memory dictionaries and inserting each file's rows with one executemany.
+    The sums over years go to yeartotal, if the database has it."""
+    def __init__(self, cursor):
+        self._c = cursor
+        self._vs = Variables(cursor)
+        self._fullvs = FullVars(cursor)
+        self.wide = bool(cursor.execute(WIDE_SQL).fetchone())
+        self.totals = bool(cursor.execute("SELECT name FROM sqlite_master WHERE name='yeartotal';").fetchone())
+        if self.wide:
+            self._scenarios = dict(cursor.execute("SELECT name, scenarioid FROM scenario;").fetchall())
+        self._simIndexed = False
+
+    def scenarioId(self, scenario):
+        "Return scenarioid of scenario, creating it if necessary (wide schema only)"
+        try:
+            return self._scenarios[scenario]
+        except KeyError:
+            self._c.execute("INSERT INTO scenario (name) VALUES (?);", (scenario, ))
+            self._scenarios[scenario] = self._c.lastrowid
+            return self._scenarios[scenario]
+
+    def write(self, scenario, iSim, sections):
+        """scenario <str> and iSim <int> identify the simulation
+        sections is a list of (varname, chunks) as in FrmtFile
+        Return the number of rows inserted."""
+        totals = {}
+        if self.wide:
+            n = self._writeWide(scenario, iSim, sections, totals)
+        else:
+            rows = []
+            demoids = range(1, 13)
+            for varname, chunks in sections:
+                varid = self._vs.id(varname)
+                for subvar, year, values in chunks:
+                    if len(values) > 12:
+                        values = _tooMany(scenario, iSim, varname, subvar, year, values)
+                    fullVarid = self._fullvs.id(varid, subvar)
+                    rows.extend(zip(repeat(scenario), repeat(iSim), repeat(fullVarid),
+                                    repeat(year), demoids, values))
+                    _accumulate(totals, fullVarid, values)
+            self._c.executemany("INSERT INTO data VALUES (?, ?, ?, ?, ?, ?);", rows)
+            n = len(rows)
+        if self.totals:
+            self._writeTotals(scenario, iSim, totals)
+        return n
+
+    def _writeWide(self, scenario, iSim, sections, totals):
+        scenarioid = self.scenarioId(scenario)
+        rows = []
+        for varname, chunks in sections:
+            varid = self._vs.id(varname)
+            for subvar, year, values in chunks:
+                if len(values) > 12:
+                    values = _tooMany(scenario, iSim, varname, subvar, year, values)
+                fullVarid = self._fullvs.id(varid, subvar)
+                _accumulate(totals, fullVarid, values)
+                # a short line leaves NULLs, which the data view drops
+                values = values + [None]*(12-len(values))
+                rows.append((scenarioid, iSim, fullVarid, year, *values))
+        self._c.executemany("INSERT INTO yeardata VALUES ({});".format(", ".join("?"*16)), rows)
+        return len(rows)
+
+    def _writeTotals(self, scenario, iSim, totals):
+        """Insert the sums over years in totals, a dict of fullvarid -> list of 12 sums,
+        with the rollups by sex and overall"""
+        rows = []
+        for fullVarid, sums in totals.items():
+            male = sum(sums[:6])
+            female = sum(sums[6:])
+            for demoid, x in enumerate(sums + [female, male, female + male], 1):
+                rows.append((scenario, iSim, fullVarid, demoid, x))
+        self._c.executemany("INSERT INTO yeartotal VALUES (?, ?, ?, ?, ?);", rows)
+
+    def delete(self, scenario, iSim):
+        "Remove the rows of one simulation"
+        if not self._simIndexed:
+            # made when first needed, so loading a new database is not slowed down by it
+            for indexStr in SIM_INDEXES[self.wide] + ([TOTAL_SIM_INDEX] if self.totals else []):
+                self._c.execute("CREATE INDEX IF NOT EXISTS {};".format(indexStr))
+            self._simIndexed = True
+        if self.wide:
+            self._c.execute("DELETE FROM yeardata WHERE scenarioid=? AND iSim=?;", (self.scenarioId(scenario), iSim))
+        else:
+            self._c.execute("DELETE FROM data WHERE scenario=? AND iSim=?;", (scenario, iSim))
+        if self.totals:
+            self._c.execute("DELETE FROM yeartotal WHERE scenario=? AND iSim=?;", (scenario, iSim))
+
+def _tooMany(scenario, iSim, varname, subvar, year, values):
+    """Warn of a line with more than 12 values and return the first 12.
+    There is a demoid only for each of the 12 age/sex groups."""
+    print("Warning: {} values for {}{} in {} of {}_{}; only the first 12 are kept".format(
+        len(values), varname, "" if subvar is None else " / " + subvar, year, scenario, iSim))
+    return values[:12]
+
+def _accumulate(totals, fullVarid, values):
+    """Add the 12 values of one year to the sums in totals[fullVarid].
+    Like SQLite's TOTAL(), text counts as 0 and missing values are skipped."""
+    sums = totals.get(fullVarid)
+    if sums is None:
+        sums = totals[fullVarid] = [0.0]*12
+    try:
+        if len(values) == 12:
+            sums[:] = map(add, sums, values)
+            return
+    except TypeError:
+        pass
+    for k, x in enumerate(values[:12]):
+        if isinstance(x, float):
+            sums[k] += x
+
+WIDE_SQL = "SELECT name FROM sqlite_master WHERE type='table' AND name='yeardata';"
+
+DEMO_TOTALS = ["F (all)", "M (all)", "Everyone"]
+
+# the indexes for deleting one simulation, by whether the schema is wide; DataWriter.delete makes them
+SIM_INDEXES = {False: ["simindex ON data (scenario, iSim)"],
+               True: ["simindex ON yeardata (scenarioid, iSim)"]}
+TOTAL_SIM_INDEX = "totalsimindex ON yeartotal (scenario, iSim)"
+
+def makeTable(d, wide=False):
+    """Create database tables in d, a cursor
+    The wide schema keeps scenario names in table scenario and has yeardata, one row per
+    scenario, iSim, fullvarid and year with values v1 to v12 for demoid 1 to 12, in place of data.
+    A view named data turns it back into one row per value, so readers need not know which schema is in use.
+    yeartotal has the sum over years of each scenario, iSim, fullvarid and demoid, where demoids 13 to 15
+    add up the 6 age groups of women, of men and all 12, as frmtReport.py reports them."""
     design = [
               ("variable", "varid integer primary key, name text, description text"),
               ("fullvar", "fullvarid integer primary key, varid references variable(varid), subCat text"),
               ("demo", "demoid integer primary key, label text, sex text, ageStart integer, ageEnd integer"),
-              ("data", "scenario text, iSim integer, fullvarid references fullvar(fullvarid), "
-               "year integer, demoid references demo(demoid), value real")
+              ("ingest", "name text primary key, size integer, mtime real, hash text"),
+              ("yeartotal", "scenario text, iSim integer, fullvarid references fullvar(fullvarid), "
+               "demoid references demo(demoid), value real")
               ]
+    indexes = ["UNIQUE INDEX fullindex ON fullvar (varid, subCat)",
+               "UNIQUE INDEX varindex ON variable (name)",
+               "UNIQUE INDEX demoindex ON demo (label)",
+               "INDEX totalindex ON yeartotal (fullvarid, scenario)"]
+    values = ["v{} real".format(i) for i in range(1, 13)]
+    if wide:
+        design += [("scenario", "scenarioid integer primary key, name text"),
+                   ("yeardata", "scenarioid references scenario(scenarioid), iSim integer, "
+                    "fullvarid references fullvar(fullvarid), year integer, " + ", ".join(values))]
+        indexes += ["UNIQUE INDEX scenarioindex ON scenario (name)",
+                    "INDEX yearindex ON yeardata (fullvarid, scenarioid)"]
+    else:
+        design.append(("data", "scenario text, iSim integer, fullvarid references fullvar(fullvarid), "
+                       "year integer, demoid references demo(demoid), value real"))
     for tbl, cols in design:
         d.execute("CREATE TABLE {} ({});".format(tbl, cols))
-    for indexStr in ("fullindex ON fullvar (varid, subCat)",
-                     "varindex ON variable (name)",
-                     "demoindex ON demo (label)"):
-        d.execute("CREATE UNIQUE INDEX {};".format(indexStr))
+    for indexStr in indexes:
+        d.execute("CREATE {};".format(indexStr))
+    if wide:
+        cases = " ".join("WHEN {0} THEN v{0}".format(i) for i in range(1, 13))
+        d.execute("CREATE VIEW data AS SELECT scenario.name AS scenario, iSim, fullvarid, year, demoid, value FROM "
+                  "(SELECT scenarioid, iSim, fullvarid, year, demoid, CASE demoid {} END AS value "
+                  "FROM yeardata CROSS JOIN demo WHERE demoid <= 12) JOIN scenario USING (scenarioid) "
+                  "WHERE value IS NOT NULL;".format(cases))
     # populate demographics
     i=1
     for label in expectCols.split():
         d.execute("INSERT INTO demo VALUES (?, ?, ?, ?, ?);", (i, label, label[0], label[1:3], label[4:6]))
         i += 1
+    # the rollups in yeartotal
+    for label, sex in zip(DEMO_TOTALS, ("F", "M", None)):
+        d.execute("INSERT INTO demo VALUES (?, ?, ?, ?, ?);", (i, label, sex, "35", "94"))
+        i += 1
+
+def openDatabase(dbase):
+    """Return a connection to dbase, creating the tables if it is new.
+    Unlike FrmtDir this keeps any existing data."""
+    conn = sqlite3.connect(dbase)
+    c = conn.cursor()
+    c.execute("SELECT name FROM sqlite_master WHERE name='data';")
+    if not c.fetchone():
+        makeTable(c)
+    return conn
+
+class SectionWriter(DataWriter):
+    """Put sections reformatted by format.py straight into the database,
+    skipping the round trip through .frmt text.
+    The rows are the same FrmtFile would produce from the .frmt file."""
+
+    def subCats(self, section):
+        """Return list of the subcategory of each category of section.
+        None means the primary outcome, as for FrmtFile.header2"""
+        if len(section.categories) < 2:
+            return [None]
+        return [None if cat == section.title or cat == "Age/Sex Breakdown" else cat
+                for cat in section.categories]
+
+    def write(self, scenario, iSim, sections):
+        """scenario <str> and iSim <int> identify the simulation
+        sections is a list of <TrackedSection>"""
+        parsed = []
+        for section in sections:
+            chunks = []
+            subCats = self.subCats(section)
+            for (year, values), texts in zip(section.rows, section.texts):
+                values = values.tolist()
+                if any(v != v for v in values):
+                    # text that is not a number, which FrmtFile.acceptData keeps as is
+                    values = [_number(x, float) for x in texts]
+                for k, subCat in enumerate(subCats):
+                    if subCat != "TBD":
+                        # as in FrmtFile.acceptData
+                        chunks.append( (subCat, year, values[12*k:12*(k+1)]) )
+            parsed.append( (section.title, chunks) )
+        return DataWriter.write(self, scenario, iSim, parsed)
+
+# user_version of a database FrmtDir is loading for the first time
+LOADING = 1
+
+def bulkPragmas(conn, fresh=True):
+    """Tune conn for bulk loading with a large page cache.
+    A fresh database gets no rollback journal and no waiting for the disk while FrmtDir first loads it.
+    Its user_version is LOADING until that load commits, so one left by a failed or killed load is
+    rebuilt from scratch next time.  After that, and for updates to an existing database, it uses a
+    write-ahead log, which also lets frmtReport read it during frmtToData.py --watch."""
+    if fresh:
+        pragmas = ("journal_mode = OFF", "synchronous = OFF")
+    else:
+        pragmas = ("journal_mode = WAL", "synchronous = NORMAL")
+    for pragma in pragmas + ("cache_size = -262144", "temp_store = MEMORY"):
+        conn.execute("PRAGMA {};".format(pragma))
+
+def loadFinished(dbase):
+    "Return False if dbase was left by a first load that did not finish"
+    conn = sqlite3.connect(dbase)
+    try:
+        return conn.execute("PRAGMA user_version;").fetchone()[0] != LOADING
+    except sqlite3.DatabaseError:
+        # e.g., damaged by a crash without a journal
+        return False
+    finally:
+        conn.close()
+
+def isWide(dbase):
+    "Return True if dbase has the wide schema"
+    conn = sqlite3.connect(dbase)
+    try:
+        return bool(conn.execute(WIDE_SQL).fetchone())
+    finally:
+        conn.close()
+
+def hasTables(dbase, names):
+    "Return True if dbase has all the tables names"
+    conn = sqlite3.connect(dbase)
+    try:
+        have = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table';")}
+        return have.issuperset(names)
+    finally:
+        conn.close()
+
+class Manifest:
+    "The files loaded into the database, from its ingest table"
+    def __init__(self, cursor):
+        self._c = cursor
+        self._files = {name: (size, mtime, hash) for name, size, mtime, hash in
+                       cursor.execute("SELECT name, size, mtime, hash FROM ingest;").fetchall()}
+
+    def __contains__(self, name):
+        return name in self._files
+
+    def __iter__(self):
+        return iter(list(self._files))
+
+    def __len__(self):
+        return len(self._files)
+
+    def changed(self, file):
+        "Return True if file <Path> is new or its size or time stamp differ from when it was loaded"
+        loaded = self._files.get(file.name)
+        return loaded is None or loaded[:2] != _stamp(file)
+
+    def known(self, name, hash):
+        "Return True if name was loaded with contents hash"
+        return name in self._files and self._files[name][2] == hash
+
+    def record(self, name, ff):
+        "Record that name was loaded from <FrmtFile> ff"
+        self._files[name] = (ff.size, ff.mtime, ff.hash)
+        self._c.execute("INSERT OR REPLACE INTO ingest VALUES (?, ?, ?, ?);", (name, ff.size, ff.mtime, ff.hash))
+
+    def remove(self, name):
+        "Forget that name was loaded"
+        del self._files[name]
+        self._c.execute("DELETE FROM ingest WHERE name=?;", (name, ))
 
 class Variables:
-    "Return rowid of variable, creating if necessary.  May cache"
+    "Return rowid of variable, creating if necessary.  All ids are kept in memory."
     def __init__(self, cursor):
         self._c = cursor
+        self._ids = dict(cursor.execute("SELECT name, varid FROM variable;").fetchall())
  
     def id(self, varname):
-        self._c.execute("SELECT varid FROM variable WHERE name=?;", (varname, ))
-        r = self._c.fetchone()
-        if r:
-            return r[0]
-        else:
-            x = self._c.execute("INSERT INTO variable (name) VALUES (?);", (varname, ))
-            self._c.execute("SELECT varid FROM variable WHERE name=?;", (varname, ))
-            r = self._c.fetchone()
-            return r[0]
+        try:
+            return self._ids[varname]
+        except KeyError:
+            self._c.execute("INSERT INTO variable (name) VALUES (?);", (varname, ))
+            self._ids[varname] = self._c.lastrowid
+            return self._ids[varname]
 
 
 class FullVars:
-    "return rowid of full variable/subvariable specification, creating as needed"
+    "return rowid of full variable/subvariable specification, creating as needed.  All ids are kept in memory."
     def __init__(self, cursor):
         self._c = cursor
-        self._cacheargs = None
-        self._cacheval = None
+        self._ids = {(varid, subCat): fullvarid for fullvarid, varid, subCat in
+                     cursor.execute("SELECT fullvarid, varid, subCat FROM fullvar;").fetchall()}
 
     def id(self, varid, subCat):
-        myargs = (varid, subCat)
-        if self._cacheargs == myargs:
-            return self._cacheval
-        self._cacheargs = myargs
         if subCat == None:
             subCat = "-"
-        self._c.execute("SELECT fullvarid FROM fullvar WHERE varid=? AND subCat=?;", (varid, subCat))
-        r = self._c.fetchone()
-        if not r:
-            x = self._c.execute("INSERT INTO fullvar (varid, subCat) VALUES (?, ?);", (varid, subCat))
-            self._c.execute("SELECT fullvarid FROM fullvar WHERE varid=? AND subCat=?;", (varid, subCat))
-            r = self._c.fetchone()
-        self._cacheval = r[0]
-        return self._cacheval
+        myargs = (varid, subCat)
+        try:
+            return self._ids[myargs]
+        except KeyError:
+            self._c.execute("INSERT INTO fullvar (varid, subCat) VALUES (?, ?);", myargs)
+            self._ids[myargs] = self._c.lastrowid
+            return self._ids[myargs]
 
 if __name__ == "__main__":
     myPat = FrmtFile.fnameRE.pattern
@@ -287,7 +786,17 @@ if __name__ == "__main__":
     i.e. the name must end with an underscore followed by digits followd by .frmt.""".format(myPat)
     args = parser.parse_args()
     inDir = getInputDirectory(args.frmtDir)
-    fdir = FrmtDir(inDir, args.database, top= None, notifyInterval=100)
+    fdir = FrmtDir(inDir, args.database, top= None, notifyInterval=100, jobs=args.jobs, rebuild=args.rebuild,
+                   wide=args.wide)
+    if args.watch:
+        fdir.watch(args.interval, args.idle)
+    statsFile = args.stats or os.path.splitext(args.database)[0] + "_ingest.json"
+    fdir.stats.write(statsFile)
+    print("Load statistics are in {}".format(statsFile))
+    if args.cube:
+        import results
+        shape = results.write_cube(args.cube, fdir._conn)
+        print("Wrote results cube {} to {}".format(shape, args.cube))
     fdir._c.execute("SELECT COUNT(*) AS NDataRows FROM data;")
     r = fdir._c.fetchone()
     print("Total data rows = {}.  Here are the first few:".format(r[0]))
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+"""Track the convergence of a Monte Carlo run as it goes
+
+runSims.js calls this after every simulation.  It reads the outputs
+chosen in the "monitor" section of MC/inputs/input_data.json from the
+simulation's MC/results/cumulative/<inp file>_<i>.dat, updates a running
+(Welford) mean and variance for each, and saves them in MC/results/monitor.json.
+	"monitor": {
+		"outputs": ["Deaths", "Deaths/F65-74"],
+		"target_rse": 0.01,
+		"min_iterations": 20
+	}
+An output is a row label (first word of a line) of the .dat file, summed
+over its columns, or row/column for one column.  Each is monitored for every inp file.
+
+The exit status is CONVERGED once at least min_iterations simulations are
+in and the relative standard error (standard error of the mean over the
+absolute mean) of every monitored output is below target_rse; otherwise 0.
+With antithetic sampling (see montecarlo.py --antithetic) the statistics
+are for pair averages, and only complete pairs count.
+"""
+from __future__ import print_function
+import argparse
+import json
+import os.path
+import sys
+import numpy as np
+
+INP_FILE_LIST = 'MC/inputs/input_data.json'
+DATFILE_DIR = 'MC/results/cumulative'
+SAMPLING_FILE = 'MC/input_variation/sampling.json'
+STATE_FILE = 'MC/results/monitor.json'
+CONVERGED = 3
+
+
+def main():
+	args = parse_args()
+	with open(INP_FILE_LIST, 'r') as f:
+		input_data = json.load(f)
+	if 'monitor' not in input_data:
+		print('Error: no "monitor" section in {}'.format(INP_FILE_LIST))
+		sys.exit(1)
+	monitor = Monitor(input_data['monitor'], input_data['inp_files'], args.state)
+	monitor.add(args.iteration)
+	monitor.save()
+	print(monitor.report())
+	if monitor.converged():
+		sys.exit(CONVERGED)
+
+
+def parse_args():
+	parser = argparse.ArgumentParser(description='Update the convergence statistics with one simulation')
+	parser.add_argument('--iteration', '-i', type=int, required=True,
+						help='the simulation just finished')
+	parser.add_argument('--state', default=STATE_FILE,
+						help='file with the running statistics [default %(default)s]')
+	return parser.parse_args()
+
+
+def is_antithetic():
+	"""True if montecarlo.py drew the inputs in antithetic pairs"""
+	if not os.path.isfile(SAMPLING_FILE):
+		return False
+	with open(SAMPLING_FILE, 'r') as f:
+		return json.load(f).get('antithetic', False)
+
+
+def read_datfile(fname, header_line=3):
+	"""Return (headers, {row label: <np.array> of values}) for a cumulative .dat file"""
+	with open(fname, 'r') as f:
+		lines = f.read().splitlines()
+	headers = lines[header_line].split()
+	rows = {}
+	for line in lines[header_line + 1:]:
+		fields = line.split()
+		if fields:
+			rows[fields[0]] = np.array([float(v) for v in fields[1:]])
+	return headers, rows
+
+
+class Welford(object):
+	"""Running mean and variance, updated one value at a time
+
+	Attr:
+		n: number of values
+		mean: their mean
+		m2: sum of squared deviations from the mean
+	"""
+
+	def __init__(self, n=0, mean=0.0, m2=0.0):
+		self.n = n
+		self.mean = mean
+		self.m2 = m2
+
+	def add(self, x):
+		self.n += 1
+		delta = x - self.mean
+		self.mean += delta / self.n
+		self.m2 += delta * (x - self.mean)
+
+	def variance(self):
+		return self.m2 / (self.n - 1) if self.n > 1 else float('nan')
+
+	def se(self):
+		"""Standard error of the mean"""
+		return np.sqrt(self.variance() / self.n) if self.n > 1 else float('nan')
+
+	def rse(self):
+		"""Relative standard error of the mean"""
+		se = self.se()
+		if se == 0:
+			return 0.0
+		return se / abs(self.mean) if self.mean != 0 else float('inf')
+
+	def to_dict(self):
+		return {'n': self.n, 'mean': self.mean, 'm2': self.m2}
+
+
+class Monitor(object):
+	"""Running statistics for the monitored outputs
+
+	Attr:
+		outputs: output names, as in input_data.json
+		target_rse: relative standard error every output must get below
+		min_iterations: simulations needed before the run may stop
+		stats: Dict of '<inp file>:<output>' -> Welford
+		pending: with antithetic pairs, values of the odd simulation waiting
+			for its partner, with its number
+		simulations: number of simulations added
+	"""
+
+	def __init__(self, config, inp_files, state_file=STATE_FILE):
+		self.outputs = config['outputs']
+		self.target_rse = config.get('target_rse', 0.01)
+		self.min_iterations = config.get('min_iterations', 10)
+		self.inp_files = [f for f in inp_files if len(f) > 0]
+		self.antithetic = is_antithetic()
+		self.state_file = state_file
+		self.stats = {name: Welford() for name in self.names()}
+		self.pending = None
+		self.simulations = 0
+		self._load()
+
+	def names(self):
+		return ['{}:{}'.format(inp_file, output) for inp_file in self.inp_files
+				for output in self.outputs]
+
+	def _load(self):
+		if not os.path.isfile(self.state_file):
+			return
+		with open(self.state_file, 'r') as f:
+			state = json.load(f)
+		for name, stat in state['stats'].items():
+			if name in self.stats:
+				self.stats[name] = Welford(**stat)
+		self.pending = state.get('pending')
+		self.simulations = state.get('simulations', 0)
+
+	def save(self):
+		state = {'stats': {name: stat.to_dict() for name, stat in self.stats.items()},
+				'pending': self.pending, 'simulations': self.simulations,
+				'antithetic': self.antithetic}
+		with open(self.state_file, 'w') as f:
+			json.dump(state, f, indent=1)
+
+	def values(self, iteration):
+		"""Return {name: value} of the outputs of simulation iteration"""
+		values = {}
+		for inp_file in self.inp_files:
+			fname = os.path.join(DATFILE_DIR, '{}_{}.dat'.format(inp_file, iteration))
+			headers, rows = read_datfile(fname)
+			for output in self.outputs:
+				row, _, col = output.partition('/')
+				if row not in rows:
+					raise KeyError('No row {} in {}'.format(row, fname))
+				if col:
+					value = rows[row][headers.index(col)]
+				else:
+					value = rows[row].sum()
+				values['{}:{}'.format(inp_file, output)] = float(value)
+		return values
+
+	def add(self, iteration):
+		"""Add the outputs of simulation iteration; the zero run is skipped"""
+		if iteration < 1:
+			return
+		values = self.values(iteration)
+		self.simulations += 1
+		if self.antithetic:
+			if iteration % 2 == 1:
+				self.pending = {'iteration': iteration, 'values': values}
+				return
+			if self.pending is None or self.pending['iteration'] != iteration - 1:
+				# partner missing, e.g., the run started at an even simulation
+				self.pending = None
+				return
+			values = {name: (v + self.pending['values'][name]) / 2 for name, v in values.items()}
+			self.pending = None
+		for name, value in values.items():
+			self.stats[name].add(value)
+
+	def converged(self):
+		if self.simulations < self.min_iterations or self.pending is not None:
+			# with antithetic pairs stop only at the end of a pair
+			return False
+		return all(stat.rse() < self.target_rse for stat in self.stats.values())
+
+	def report(self):
+		unit = 'pairs' if self.antithetic else 'simulations'
+		lines = ['{:<40} {:>8} {:>16} {:>12} {:>10}'.format('output', unit, 'mean', 'se', 'rse')]
+		for name, stat in self.stats.items():
+			lines.append('{:<40} {:>8} {:>16.6g} {:>12.4g} {:>10.4g}'.format(
+				name, stat.n, stat.mean, stat.se(), stat.rse()))
+		return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+	main()
@@ -2,44 +2,66 @@
 from __future__ import print_function
 from operator import add
 import argparse
-import csv
 import collections
 import json
 import numpy as np
-from scipy import stats
+from scipy import special, stats
+from scipy.stats import qmc
 import os.path
 import re
 import sys
+import zlib
+import hashlib
+import multiprocessing
+import warnings
+from numpy.random import SeedSequence
 from randomgen import Generator, PCG64
+from draws import DrawArchive
+
+SAMPLING_FILE = os.path.join('MC', 'input_variation', 'sampling.json')
+CACHE_DIR = os.path.join('MC', 'cache')
 
 
 def main():
-	global RG  # the random generator
 	args = parse_args()
-	seed = args.seed
-	if seed:
-		RG = Generator(PCG64(seed, args.iteration, mode="sequence"))
-	else:
-		RG = Generator(PCG64(mode="sequence"))
+	if args.batch:
+		run_batch(args)
+		return
+	if args.verify_shard:
+		verify_shard(args)
+		return
+	streams = Streams(args.seed)
+	iteration = args.iteration or 0
+	archive = DrawArchive()
 
 	input_data = get_input_data()
 
-	dat_files = input_data['dat_files']
-	for datfiledata in dat_files:
-		datfile = DatFile(datfiledata, RG)
-		if not args.zero_run:
-			datfile.vary()
-			datfile.save_raw_data()
+	datfiles, effects = read_inputs(input_data)
+	if not args.zero_run:
+		design = make_design(args, streams, datfiles, effects, iteration)
+		draws = draw_iterations(streams, datfiles, effects, [iteration], design,
+								args.antithetic)
+		if args.save:
+			save_sampling(args)
+		for datfile, varied in zip(datfiles, draws[:-1]):
+			datfile.apply(varied[0])
+		effects.set_draw(draws[-1][0])
+
+	for datfile in datfiles:
+		if args.save or not args.zero_run:
+			# the zero run records the unvaried values
+			datfile.save_raw_data(archive, iteration)
 		datfile.print_mc()
 
 	inp_files = input_data['inp_files']
 	for i, fname in enumerate(inp_files):
-		inpfile = InpFile(fname)
+		inpfile = InpFile(fname, effects)
 		if i == 0 and args.save:
 			if args.zero_run:
 				inpfile.effects.print_labels()
 			else:
 				inpfile.effects.print_data()
+				inpfile.effects.save_raw_data(archive, iteration)
 
 		if args.zero_run:
 				inpfile.count_varied_lines()
@@ -49,6 +71,327 @@ def main():
 		inpfile.print_mc()
 
 
+def run_batch(args):
+	"""Generate the inputs for many simulations in one process.
+
+	The _mc0 templates, _sd files and inp_distribution.txt are read once.
+	Since every value comes from a stream named by its simulation (see Streams)
+	the results match those of individual runs.
+
+	Simulation i gets outdir/i/modfile/<name>_mc.dat and outdir/i/<prefix>_mc.inp,
+	laid out so the directory can be copied over the model directory.
+	"""
+	start, count = args.batch
+	iterations = range(start, start + count)
+	input_data = get_input_data()
+
+	datfiles, effects = read_inputs(input_data)
+	inpfiles = [InpFile(fname, effects) for fname in input_data['inp_files']]
+	streams = Streams(args.seed)
+	design = make_design(args, streams, datfiles, effects, start + count - 1)
+	draws = draw_iterations(streams, datfiles, effects, iterations, design, args.antithetic)
+	dat_draws, inp_draws = draws[:-1], draws[-1]
+
+	if args.save:
+		save_sampling(args)
+		archive = DrawArchive()
+		for datfile, varied in zip(datfiles, dat_draws):
+			archive.write(datfile.file_data['filename'], datfile.slot_labels(), start, varied)
+		if inpfiles:
+			archive.write(effects.archive_name, effects.key_components, start, inp_draws)
+			effects.save_write(''.join(effects.format_data(values, label=iteration)
+								for iteration, values in zip(iterations, inp_draws)))
+
+	for n, iteration in enumerate(iterations):
+		iterdir = os.path.join(args.outdir, str(iteration))
+		for datfile, varied in zip(datfiles, dat_draws):
+			datfile.apply(varied[n])
+			datfile.print_mc(os.path.join(iterdir, datfile.mc_path))
+		effects.set_draw(inp_draws[n])
+		for inpfile in inpfiles:
+			inpfile.vary()
+			inpfile.print_mc(os.path.join(iterdir, inpfile.mc_path))
+
+
+def read_inputs(input_data):
+	"""Return list of DatFile's and the Effects"""
+	datfiles = [DatFile(datfiledata) for datfiledata in input_data['dat_files']]
+	return datfiles, Effects()
+
+
+def draw_iterations(streams, datfiles, effects, iterations, design=None, antithetic=False):
+	"""Return varied values for the simulations in iterations.
+
+	The result is a list with an (iteration x row x column) array for
+	each dat file followed by an (iteration x key) array for the effects.
+	The basic random values of each dat file, and the uniforms for the
+	effects, are transformed for all iterations at once.
+
+	With a Design the basic random values come from its points
+	instead of the streams.
+
+	If antithetic, simulations 2k-1 and 2k are a pair: the even one
+	reflects the basic random values of the odd one (u -> 1-u, z -> -z).
+	"""
+	count = len(iterations)
+	sources, reflected = antithetic_sources(iterations, antithetic)
+	if design is not None:
+		if antithetic:
+			# one design point per pair
+			u = design.points((sources + 1) // 2)
+		else:
+			u = design.points(sources)
+		u[reflected] = 1 - u[reflected]
+		dat_rnd = []
+		offset = 0
+		for datfile in datfiles:
+			shape = datfile.sdfile.base_shape()
+			size = int(np.prod(shape))
+			dat_rnd.append(datfile.sdfile.base_from_uniform(
+				u[:, offset:offset + size].reshape((count,) + shape)))
+			offset += size
+		inp_u = u[:, offset:]
+	else:
+		dat_rnd = [np.empty((count,) + datfile.sdfile.base_shape()) for datfile in datfiles]
+		inp_u = np.empty((count, len(effects.slots)))
+		for n, iteration in enumerate(sources.tolist()):
+			for datfile, rnd in zip(datfiles, dat_rnd):
+				rnd[n] = datfile.sdfile.draw_base(streams.generator(iteration, datfile.stream_name))
+			inp_u[n] = effects.draw_base(streams, iteration)
+		for datfile, rnd in zip(datfiles, dat_rnd):
+			rnd[reflected] = datfile.sdfile.reflect(rnd[reflected])
+		inp_u[reflected] = 1 - inp_u[reflected]
+	return [datfile.draw(rnd) for datfile, rnd in zip(datfiles, dat_rnd)] + \
+		[effects.transform(inp_u)]
+
+
+def antithetic_sources(iterations, antithetic):
+	"""Return (sources, reflected) <np.array>s for iterations.
+
+	sources are the simulations whose basic random values each iteration
+	uses, and reflected marks those to reflect.  Without antithetic every
+	simulation is its own source.  With it even simulations use the values
+	of the preceding odd one; simulation 0, the zero run, has no partner.
+	"""
+	iterations = np.asarray(iterations, dtype=int)
+	if not antithetic:
+		return iterations, np.zeros(iterations.shape, dtype=bool)
+	reflected = (iterations > 0) & (iterations % 2 == 0)
+	return np.where(reflected, iterations - 1, iterations), reflected
+
+
+def save_sampling(args):
+	"""Record how the inputs were sampled for sum_results.py and others"""
+	dirname = os.path.dirname(SAMPLING_FILE)
+	if not os.path.isdir(dirname):
+		os.makedirs(dirname)
+	with open(SAMPLING_FILE, 'w') as f:
+		json.dump({'design': args.design, 'antithetic': args.antithetic, 'seed': args.seed}, f)
+
+
+def make_design(args, streams, datfiles, effects, last):
+	"""Return the Design requested by args, or None for plain random sampling.
+
+	The design covers simulations 1 to --design-size, by default to last.
+	With antithetic pairs each point serves a pair of simulations.
+	"""
+	if args.design == 'random':
+		return None
+	if not args.seed:
+		print('Error: --design requires --seed')
+		sys.exit(1)
+	size = args.design_size
+	if not size:
+		if not args.batch:
+			print('Error: --design requires --design-size for a single simulation')
+			sys.exit(1)
+		size = last
+	if args.antithetic:
+		size = (size + 1) // 2
+	dims = sum(int(np.prod(datfile.sdfile.base_shape())) for datfile in datfiles) + \
+		len(effects.slots)
+	return Design(args.design, size, dims, streams)
+
+
+def _draw_shard(seed, iterations, antithetic):
+	"""draw_iterations for one shard, in a fresh process"""
+	datfiles, effects = read_inputs(get_input_data())
+	return draw_iterations(Streams(seed), datfiles, effects, iterations, antithetic=antithetic)
+
+
+def verify_shard(args):
+	"""Check that drawing simulations in shards reproduces a serial run.
+
+	The serial draws are made in this process, the shards in a pool of
+	separate processes, and every value must be bit-for-bit identical.
+	A digest of the draws is printed so runs on different machines can
+	be compared as well.
+	"""
+	if not args.seed:
+		print('Error: --verify-shard requires --seed')
+		sys.exit(1)
+	start, count, nshards = args.verify_shard
+	iterations = range(start, start + count)
+	datfiles, effects = read_inputs(get_input_data())
+	serial = draw_iterations(Streams(args.seed), datfiles, effects, iterations,
+							antithetic=args.antithetic)
+
+	bounds = np.linspace(start, start + count, nshards + 1).astype(int)
+	shards = [range(lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+	pool = multiprocessing.Pool(len(shards))
+	try:
+		results = pool.starmap(_draw_shard, [(args.seed, shard, args.antithetic)
+											for shard in shards])
+	finally:
+		pool.close()
+	sharded = [np.concatenate(parts) for parts in zip(*results)]
+
+	names = [datfile.stream_name for datfile in datfiles] + ['inp_distribution']
+	digest = hashlib.sha256()
+	bad = set()
+	for name, a, b in zip(names, serial, sharded):
+		digest.update(a.tobytes())
+		for n, iteration in enumerate(iterations):
+			if a[n].tobytes() != b[n].tobytes():
+				print('{}: simulation {} differs'.format(name, iteration))
+				bad.add(iteration)
+	print('Draws for simulations {}-{}: sha256 {}'.format(
+		start, start + count - 1, digest.hexdigest()))
+	if bad:
+		print('FAILED: {} of {} simulations differ between serial and {} shards'.format(
+			len(bad), count, len(shards)))
+		sys.exit(1)
+	print('OK: {} shards reproduce the serial run exactly'.format(len(shards)))
+
+
+class Design(object):
+	"""Uniforms for simulations 1 to size from an experimental design
+
+	Every basic random value of every dat file, followed by the uniform
+	for each Effects slot, is one dimension of the design, and each
+	simulation, or antithetic pair, is one point.
+		lhs		Latin hypercube: each dimension has exactly one point in
+				each of size equal-probability strata
+		sobol	scrambled Sobol low-discrepancy sequence; best when size
+				is a power of 2
+
+	The points depend only on the seed, size and dimensions, so any
+	process can reproduce them.  They are saved in CACHE_DIR the first
+	time, and the single simulation processes of a run read just their
+	own rows from there instead of building the whole design again.
+
+	Attr:
+		kind: 'lhs' or 'sobol'
+		size: number of points
+		dims: number of uniforms per simulation
+		cache_path: where the points are saved
+	"""
+
+	_cache_version = 1
+
+	def __init__(self, kind, size, dims, streams):
+		self.kind = kind
+		self.size = size
+		self.dims = dims
+		if kind not in ('lhs', 'sobol'):
+			raise ValueError("Unknown design {}".format(kind))
+		seed = streams.integer_seed('design:' + kind)
+		self.cache_path = os.path.join(CACHE_DIR, 'design-{}-{}.npy'.format(
+			kind, self._cache_key(seed)))
+		self._points = self._load_cache()
+		if self._points is None:
+			self._points = self._generate(seed)
+			self._save_cache()
+
+	def _cache_key(self, seed):
+		"""Return hex digest of everything the points depend on"""
+		text = json.dumps([self.kind, self.size, self.dims, seed, self._cache_version])
+		return hashlib.sha256(text.encode('utf-8')).hexdigest()[:20]
+
+	def _generate(self, seed):
+		"""Return the (size x dims) points"""
+		if self.kind == 'lhs':
+			sampler = qmc.LatinHypercube(d=self.dims, seed=seed)
+		else:
+			sampler = qmc.Sobol(d=self.dims, scramble=True, seed=seed)
+		with warnings.catch_warnings():
+			# Sobol warns if size is not a power of 2
+			warnings.simplefilter('ignore')
+			points = sampler.random(self.size)
+		# keep the inverse CDFs finite
+		eps = np.finfo(float).eps
+		np.clip(points, eps, 1 - eps, out=points)
+		return points
+
+	def _load_cache(self):
+		"""Return the points memory mapped from cache_path; None if unavailable"""
+		if not os.path.isfile(self.cache_path):
+			return None
+		try:
+			points = np.load(self.cache_path, mmap_mode='r')
+		except (IOError, OSError, ValueError):
+			return None
+		if points.shape != (self.size, self.dims):
+			return None
+		return points
+
+	def _save_cache(self):
+		"""Write the points to cache_path"""
+		if not os.path.isdir(CACHE_DIR):
+			os.makedirs(CACHE_DIR)
+		# write under another name first so concurrent runs never see a partial file
+		tmp_path = '{}.{}.tmp'.format(self.cache_path, os.getpid())
+		with open(tmp_path, 'wb') as f:
+			np.save(f, self._points)
+		os.replace(tmp_path, self.cache_path)
+
+	def points(self, numbers):
+		"""Return (len(numbers) x dims) <np.array> of uniforms for points 1, 2, ...
+
+		Point i is for simulation i, or for pair i with antithetic sampling."""
+		numbers = np.asarray(numbers)
+		if numbers.min() < 1 or numbers.max() > self.size:
+			print('Error: the {} design only has {} points'.format(self.kind, self.size))
+			sys.exit(1)
+		return self._points[numbers - 1]
+
+
+class Streams(object):
+	"""Independent random number streams for a run
+
+	Every random value is drawn from a stream that is a pure function of
+	(seed, iteration, name).  The stream is a PCG64 generator initialized by
+	SeedSequence(seed, spawn_key=(iteration, crc32(name))), so it does not
+	depend on which process or machine draws it, or what was drawn before.
+	Names are
+		dat:<filename>		the basic random values for a dat file
+		group:<g>			the uniform shared by components with group g=<g>
+							in inp_distribution.txt
+		effect:<key>:<n>	the uniform for the n'th (from 0) ungrouped component of key
+	With antithetic sampling even simulations draw nothing of their own;
+	they reflect the values of the preceding simulation.
+
+	Attr:
+		entropy: the seed, or random entropy if no seed was given
+	"""
+
+	def __init__(self, seed=None):
+		if seed:
+			self.entropy = seed
+		else:
+			self.entropy = SeedSequence().entropy
+
+	def generator(self, iteration, name):
+		"""Return a fresh generator for stream name of simulation iteration"""
+		key = zlib.crc32(name.encode('utf-8'))
+		return Generator(PCG64(SeedSequence(self.entropy, spawn_key=(iteration, key))))
+
+	def integer_seed(self, name):
+		"""Return an integer seed for name that does not depend on the simulation"""
+		key = zlib.crc32(name.encode('utf-8'))
+		return int(SeedSequence(self.entropy, spawn_key=(key,)).generate_state(1)[0])
+
+
 def parse_args():
 	parser = argparse.ArgumentParser()
 	inpgroup = parser.add_argument_group('.inp files, -r is default')
@@ -65,7 +408,30 @@ def parse_args():
 	options_group.add_argument('--save','-s',help='save montecarlo results to modfile',
 							action='store_true')
 	options_group.add_argument('--iteration', '-i', type=int, help='Which simulation this is.')
-	options_group.add_argument('--seed', type=int, help="This seed and the iteration number pick a random number stream")
+	options_group.add_argument('--seed', type=int, help="This seed and the iteration number pick the random number streams")
+	batch_group = parser.add_argument_group('batch generation')
+	batch_group.add_argument('--batch', type=int, nargs=2, metavar=('START', 'COUNT'),
+							help='generate inputs for simulations START to START+COUNT-1 '
+							'in one process, writing them below --outdir')
+	batch_group.add_argument('--outdir', default='MC/batch',
+							help='directory for --batch output, one subdirectory per '
+							'simulation [default %(default)s]')
+	batch_group.add_argument('--verify-shard', type=int, nargs=3,
+							metavar=('START', 'COUNT', 'SHARDS'),
+							help='check that drawing simulations START to START+COUNT-1 in '
+							'SHARDS separate processes reproduces a serial run exactly. '
+							'Requires --seed. Writes nothing.')
+	design_group = parser.add_argument_group('sampling design')
+	design_group.add_argument('--design', choices=('random', 'lhs', 'sobol'), default='random',
+							help='random sampling, a Latin hypercube, or a scrambled Sobol '
+							'sequence over simulations 1 to --design-size. lhs and sobol '
+							'require --seed [default %(default)s]')
+	design_group.add_argument('--design-size', type=int,
+							help='number of simulations the design covers. Required '
+							'with -i; with --batch defaults to the last simulation')
+	design_group.add_argument('--antithetic', action='store_true',
+							help='sample simulations in antithetic pairs: each even simulation '
+							'reflects the basic random values of the one before it')
 	return parser.parse_args()
 
 
@@ -108,36 +474,36 @@ class VFile(object):
 	"""Base class for files to be varied
 
 	Attr:
-		mc_file: File to write varied output to
-		lines: Raw lines of mc0 file
+		mc_path: Path of file to write varied output to
+		template: Raw lines of mc0 file, never modified
+		lines: Lines of the current variation, initially the template
 		frmt_str: String to format data lines
 		save: Boolean flag - if True save variation info
 	"""
 
 	def __init__(self,fname):
 		pref,ext = fname.split('.')
-		self.mc_file = open(pref + '_mc.' + ext,'w')
-		self.lines = read_lines(pref + '_mc0.' + ext)
+		self.mc_path = pref + '_mc.' + ext
+		self.template = read_lines(pref + '_mc0.' + ext)
+		self.lines = list(self.template)
 		self.frmt_str = ''
 
 	def num_lines(self):
 		return len(self.lines)
 
-	def print_mc(self):
-		"""Print varied lines to  mc_file"""
-		for line in self.lines:
-			print(line,file=self.mc_file)
-		# without the close sometimes the file is not written out
-		# though it seems as if it should be anyway
-		# There do not appear to be any subsequent writes to the file after this call is invoked
-		self.mc_file.close()
+	def print_mc(self,path=None):
+		"""Print varied lines to path, by default mc_path"""
+		self.write_mc('\n'.join(self.lines) + '\n',path)
 
-	def vary(self):
-		for line_num in range(self.num_lines()):
-			self.vary_line(line_num)
-
-	def vary_line(self,line):
-		pass
+	def write_mc(self,text,path=None):
+		"""Write text to path, by default mc_path, in a single write"""
+		if path is None:
+			path = self.mc_path
+		dirname = os.path.dirname(path)
+		if dirname and not os.path.isdir(dirname):
+			os.makedirs(dirname)
+		with open(path,'w') as mc_file:
+			mc_file.write(text)
 
 	def format_line(self,out_list):
 		line_format = self.lead_spaces * ' ' + len(out_list) * self.frmt_str
@@ -152,34 +518,71 @@ class DatFile(VFile):
 
 	Attr:
 		sdfile: SDFile object containing standard deviation information
+		stream_name: Name of the random number stream for this file
+		data_lines: Indices of the data lines in the template
+		file_format: Format string for the whole file, with a slot for each
+			varied value in row order
+		varied: <np.array> of values of the current variation, None if not varied
+		text: Contents of the current variation, None if not varied
 	"""
 
-	def __init__(self,file_data, random_generator):
+	def __init__(self,file_data):
 		self.file_data = file_data
 		self.fpath = os.path.join('modfile',file_data['filename'] + '.dat')
 		VFile.__init__(self,self.fpath)
-		self.sdfile = SDFile(file_data,self.lines, random_generator)
+		self.sdfile = SDFile(file_data,self.template)
+		self.stream_name = 'dat:' + file_data['filename']
+		self.data_lines = self.sdfile.data_lines
 		self.frmt_str = ''
 		self.lead_spaces = 0
 		self.set_format()
-		self.data_vec = []
-
-	def save_raw_data(self):
-		with open('MC/input_variation/dat_files/' + self.file_data['filename'] + '.csv', 'a',newline='') as totals_file:
-			#print(self.data_vec)
-			writer = csv.writer(totals_file)
-			writer.writerow(self.data_vec)
-
-	def vary_line(self,line_num):
-		means = self.lines[line_num].split()
-		if is_data_line(means):
-			varied = self.sdfile.get_variation(line_num)
-			if 'sumToOne' in self.file_data and self.file_data['sumToOne']:
-				varied[:] = [v / sum(varied) for v in varied]
-
-			self.data_vec.append(varied)
-			formatted = self.format_line(varied)
-			self.replace_line(formatted,line_num)
+		self.compile_template()
+		self.varied = None
+		self.text = None
+
+	def slot_labels(self):
+		"""Labels of the varied values, in row order, for the draw archive"""
+		return ['line{}_col{}'.format(line_num + 1,col + 1)
+				for line_num in self.data_lines for col in range(self.sdfile.cols)]
+
+	def save_raw_data(self,archive,iteration):
+		"""Record the current values, or the means if not varied, in archive"""
+		varied = self.sdfile.means if self.varied is None else self.varied
+		archive.write(self.file_data['filename'],self.slot_labels(),iteration,[varied])
+
+	def draw(self,rnd):
+		"""Return <np.array> of varied values, one row per data line
+
+		rnd are basic random values as for SDFile.get_variation, and may
+		be for many iterations at once."""
+		varied = self.sdfile.get_variation(rnd)
+		if 'sumToOne' in self.file_data and self.file_data['sumToOne']:
+			varied = varied / varied.sum(axis=-1, keepdims=True)
+		return varied
+
+	def apply(self,varied):
+		"""Replace the data lines of the template with rows of varied"""
+		self.varied = varied
+		self.text = self.render(varied)
+
+	def render(self,varied):
+		"""Return text of the file with the data lines replaced by varied"""
+		return self.file_format.format(*varied.ravel().tolist())
+
+	def print_mc(self,path=None):
+		"""Write the current variation, or the template if not varied"""
+		if self.text is None:
+			VFile.print_mc(self,path)
+		else:
+			self.write_mc(self.text,path)
+
+	def compile_template(self):
+		"""Set 'file_format' from the template and 'frmt_str'"""
+		line_format = self.lead_spaces * ' ' + self.sdfile.cols * self.frmt_str
+		lines = [line.replace('{','{{').replace('}','}}') for line in self.template]
+		for line_num in self.data_lines:
+			lines[line_num] = line_format
+		self.file_format = '\n'.join(lines) + '\n'
 
 	def set_format(self):
 		"""Set 'frmt_str' based on last line of dat file"""
@@ -196,25 +599,27 @@ class SDFile(object):
 	Attr:
 		file_data:	model specification
 		lines: Raw lines in file
-		mean_lines: values from the means file
-		block_nums: List of block indices for each data line
+		data_lines: Indices of the data lines in the file
+		means: <np.array> rows x cols of means, one row per data line
+		sds: <np.array> rows x cols of standard deviations
+		block_nums: <np.array> of the block index for each row of means
 		num_blocks: Integer number of blocks in file
-		RG a <RandomGenerator> to use
 		cols:	Number of columns of data
+		distribution: 'normal', 'lognormal' or 'beta'
 
-	Internal Use only
-		_do_line:	a function taking a line number as argument
-			Process that line appropriately, returning random values
+	The basic random values of a variation are from the standard normal for
+	normal distributions and uniform on [0, 1] for the others.  Their shape
+	is given by base_shape().
 
-		_do_dist:	a function taking quantiles (only for correlated variables),
-					means and sds as arguments.  Called by _do_line.
-					returns appropriate "random" values.
+	Internal Use only
+		_do_dist:	a function taking the basic random values, expanded
+					to one per cell, and returning the varied values.
 
 
 	This can produce random variables that are correlated by block or row.
 	If the correlation is by block, the correlation is actually across
 	lines aka rows that are members of the same block.  The values in different 
-	columns, returned by _do_lines, are uncorrelated with eah other within a row.
+	columns are uncorrelated with eah other within a row.
 	In this scenario, different rows usually correspond to different ages.  There may
 	be 2 such groups for male and female; in those cases the men and women are also correlated.
 
@@ -226,220 +631,217 @@ class SDFile(object):
 	but for other distributions the value will be lower because it is impossible to achieve 1.0.
 	In that case, the values are completely dependent, but not linearly dependent.
 
-	
+	Uncorrelated values are produced the same way, but with a separate basic
+	random value for each cell.
+
+	All the work is done on whole arrays, and may be done for many variations
+	at once by giving the basic random values an extra leading dimension.
+
+	The parsed values and derived parameters are cached in CACHE_DIR,
+	keyed by a hash of the _mc0.dat and _sd.dat files and file_data,
+	so later simulations and runs skip the parsing.
 	"""
 
-	def __init__(self, file_data, mean_lines, random_generator):
+	# attributes saved in the cache
+	_cached = ('data_lines', 'means', 'sds', 'num_blocks', 'block_nums',
+				'_mu', '_sigma', '_varied', '_alpha', '_beta', '_switch')
+	_cache_version = 1
+
+	def __init__(self, file_data, mean_lines):
 		self.file_data = file_data
-		self.RG = random_generator
 		sdpath = os.path.join('modfile',file_data['filename'] + '_sd.dat')
-		self.mean_lines = mean_lines
 		self.lines = read_lines(sdpath)
-		self.block_nums = [-1] * len(self.lines)
-		self.cols = self._count_cols()
 		self.row_offset = 1
 		if 'rowLabels' in file_data and file_data['rowLabels'] == False:
 			self.row_offset = 0
-
-		if 'distribution' in self.file_data and \
-			self.file_data['distribution'] in ('beta', 'lognormal'):
-			self._basic_generator = self.RG.random   # uniform [0, 1]
+		self.distribution = file_data.get('distribution', 'normal')
+		self.correlation = file_data['correlation']
+		self.cache_path = os.path.join(CACHE_DIR, '{}-{}.npz'.format(
+			file_data['filename'], self._cache_key(mean_lines)))
+
+		if not self._load_cache():
+			self.data_lines = [i for i,line in enumerate(mean_lines)
+								if is_data_line(line.split())]
+			self.means = self._parse(mean_lines)
+			self.sds = self._parse(self.lines)
+			if self.correlation == 'block':
+				self._set_block_nums()
+			if self.distribution == 'beta':
+				self._set_beta_parameters()
+			elif self.distribution == 'lognormal':
+				self._set_lognormal_parameters()
+			self._save_cache()
+		self.cols = self.means.shape[1]
+
+		if self.distribution == 'beta':
+			self._do_dist = self._correlated_beta
+		elif self.distribution == 'lognormal':
+			self._do_dist = self._correlated_lognormal
+		elif self.distribution == 'normal':
+			self._do_dist = self._correlated_normal
 		else:
-			self._basic_generator = self.RG.standard_normal
-
-		if file_data['correlation'] == 'block':
-			self._set_block_nums()
-			self._do_line = self.vary_by_block
-			dims = (file_data['blocksPerGroup'], self.cols)
-			self._rnd = self._basic_generator(dims)
-			self._set_correlated_distribution()
-		elif file_data['correlation'] == 'row':
-			self._rnd = self._basic_generator()
-			# note _rnd will be changed as we advance through the file
-			self._do_line = self.vary_by_row
-			self._set_correlated_distribution()
-		else:
-			self._do_line = self.vary_individually
-			self._set_uncorrelated_distribution()
-
-	def _set_correlated_distribution(self):
-		"Establish right function to call for each line"
-		if 'distribution' in self.file_data:
-			distn = self.file_data['distribution']
-			if distn == 'beta':
-				self._do_dist = self._correlated_beta
-				return
-			elif distn == 'lognormal':
-				self._do_dist = self._correlated_lognormal
-				return
-			elif distn != 'normal':
-				raise ValueError("Unknow distribution type {}".format(distn))
-		# normal is the default
-		self._do_dist = self._correlated_normal
-
-	def _set_uncorrelated_distribution(self):
-		"Establish right function to call for each line when all values are independent"
-		if 'distribution' in self.file_data:
-			distn = self.file_data['distribution']
-			if distn == 'beta':
-				self._do_dist = self._rand_beta
-				return
-			elif distn == 'lognormal':
-				self._do_dist = self._rand_lognormal
-				return
-			elif distn != 'normal':
-				raise ValueError("Unknow distribution type {}".format(distn))
-		# normal is the default
-		self._do_dist = self._rand_normal
-
-	def _count_cols(self):
-		"""Get number of data columns"""
-		for line in self.lines:
-			if is_data_line(line.split()):
-				return len(line.split()) - 1
+			raise ValueError("Unknow distribution type {}".format(self.distribution))
+
+	def _cache_key(self, mean_lines):
+		"""Return hex digest of everything the cached values depend on"""
+		digest = hashlib.sha256()
+		for text in ('\n'.join(mean_lines), '\n'.join(self.lines),
+					json.dumps(self.file_data, sort_keys=True), str(self._cache_version)):
+			digest.update(text.encode('utf-8'))
+			digest.update(b'\0')
+		return digest.hexdigest()[:20]
+
+	def _load_cache(self):
+		"""Set the cached attributes from cache_path; return False if unavailable"""
+		if not os.path.isfile(self.cache_path):
+			return False
+		try:
+			with np.load(self.cache_path) as cache:
+				values = {name: cache[name] for name in cache.files}
+		except (IOError, OSError, ValueError, KeyError):
+			return False
+		for name, value in values.items():
+			setattr(self, name, value)
+		self.data_lines = self.data_lines.tolist()
+		if 'num_blocks' in values:
+			self.num_blocks = int(self.num_blocks)
+		return True
+
+	def _save_cache(self):
+		"""Write the cached attributes to cache_path"""
+		values = {name: getattr(self, name) for name in self._cached if hasattr(self, name)}
+		if not os.path.isdir(CACHE_DIR):
+			os.makedirs(CACHE_DIR)
+		# write under another name first so concurrent runs never see a partial file
+		tmp_path = '{}.{}.tmp'.format(self.cache_path, os.getpid())
+		with open(tmp_path, 'wb') as f:
+			np.savez(f, **values)
+		os.replace(tmp_path, self.cache_path)
+
+	def _parse(self, lines):
+		"""Return <np.array> of the values on the data lines"""
+		try:
+			return np.array([[float(x) for x in lines[i].split()[self.row_offset:]]
+							for i in self.data_lines])
+		except (ValueError, IndexError):
+			print('Data lines of {}_mc0.dat and {}_sd.dat do not match'.format(
+				self.file_data['filename'], self.file_data['filename']))
+			sys.exit(1)
 
 	def _set_block_nums(self):
 		"""Set num_blocks, block_nums"""
-		n_line = 0
-		for i,line in enumerate(self.lines):
-			if is_data_line(line.split()):
-				self.block_nums[i] = n_line // 6
-				n_line += 1
-				self.num_blocks = n_line // 6
-
-	def get_block_num(self,line_num):
-		return self.block_nums[line_num] % self.file_data['blocksPerGroup']
-
-
-	def _correlated_normal(self, e, means, sds):
-		"""Return <np.array> of perfectly correlated normals.
-
-		e is an error term, or a vector of error terms, from
-		the standard normal.
-		means and sds are the means and standard deviations
-		of the distributions from which we draw.
-		"""
-		return means + e*sds
-
-	def _rand_normal(self, means, sds):
-		"""Return <np.array> of random variables drawn from normals
-		with indicated means and sds.
-		"""
-		return self.RG.normal(means, sds)
-
-	def _correlated_lognormal(self, q, means, sds):
-		"""Return <np.array> of correlated or uncorrelated log-normals.
-
-		q are the quantiles to use.  If None, generate independent random variables.
+		n_line = np.arange(len(self.data_lines))
+		self.num_blocks = len(self.data_lines) // 6
+		self.block_nums = (n_line // 6) % self.file_data['blocksPerGroup']
 
-		Each individual element has mean and sd as given in input vectors.
-		q must either be the same size as those vectors or a single number.
+	def _set_lognormal_parameters(self):
+		"""Derive mu and sigma of the related normal.
 
 		The input means and sds refer to the lognormal variable, not to
-		the related normal variable.  This function derives appropriate
-		parameters for the lognormal parameterized in terms of mu and
-		sigma, which do refer to the related normal variable.
+		the related normal variable.  The lognormal is parameterized in
+		terms of mu and sigma, which do refer to the related normal variable.
+		Cells with sd=0 will always be the mean.
 
 		Formulae for translation from
 		https://en.wikipedia.org/wiki/Log-normal_distribution#Alternative_parameterizations
 		"""
-		# convert from lists, which don't support math
-		means = np.array(means)
-		sds = np.array(sds)
-		f = 1.0 + np.power(sds/means, 2)
-		mu = np.log(means/np.sqrt(f))
-		sigma = np.sqrt(np.log(f))
-		res = np.empty_like(means)
-		mask = (sigma>0.0)
-		# scipy docs say if log(Y) has mean mu and sd sigma then
-		# use s = sigma and scale = exp(mu)
-		if q is None:
-			res[mask] = self.RG.lognormal(mu[mask], sigma[mask])
-		else:
-			q0 = np.array(q, copy=False)  # q might be a single number
-			if q0.size > 1:
-				res[mask] = stats.lognorm.ppf(q[mask], s = sigma[mask], scale = np.exp(mu[mask]))
-			else:
-				res[mask] = stats.lognorm.ppf(np.full(sum(mask), q), s = sigma[mask], scale = np.exp(mu[mask]))
-		# It seems ~x is same as np.logical_not(x) but I can't find that documented anywhere.
-		mask = np.logical_not(mask)
-		# if sd=0 use original mean
-		res[mask] = means[mask]
-		return res
-
-	def _rand_lognormal(self, means, sds):
-		return self._corr_lognormal(None, means, sds)
-
-	def _correlated_beta(self, q, means, sds):
-		"""Return <np.array> of correlated or uncorrelated beta random variables.
+		with np.errstate(divide='ignore', invalid='ignore'):
+			f = 1.0 + np.power(self.sds/self.means, 2)
+			self._mu = np.log(self.means/np.sqrt(f))
+			self._sigma = np.sqrt(np.log(f))
+		self._varied = self._sigma > 0.0
+		# harmless values for the cells that are not varied
+		self._mu[~self._varied] = 0.0
+		self._sigma[~self._varied] = 1.0
+
+	def _set_beta_parameters(self):
+		"""Derive alpha and beta.
 
 		Means in [-1, 0) are permitted and interpreted as negative of the 
 		corresponding value from a beta with abs(means).
 
 		If the mean is 0 or the sd<=0 the generated random variable is
 		always the mean.
-
-		q are the quantiles to use.  If None, generate uncorrelated random variables.
-		Each individual element has mean and sd as given in input vectors.
-		q must either be the same size as those vectors or a single number.
 		"""
-		res = empty_like(means)
-		# mean of 0 should imply sd of 0
-		mask = (means == 0.0) | (sds <= 0.0)
-		res[mask] = means[mask]
-		mask = np.logical_not(mask)
-		switch = (means < 0.0)
-		means = np.abs(means)
-		# to avoid division by zero must remove masked elements
-		ms = means[mask]
-		ss = sds[mask]
-		alpha = ((1 - ms) / ss ** 2 - (1 / ms)) * ms ** 2
-		beta = alpha * (1 / ms - 1)
-		if q is None:
-			res[mask] = self.RG.beta(alpha, beta)
-		else:
-			res[mask] = stats.beta.ppf(q[mask], a = alpha, b = beta )
-		res[switch] = - res[switch]
-		return res
-
-	def _rand_beta(self, means, sds):
-		"return random values from the beta distribution"
-		return self._correlated_beta(None, means, sds)
-
-
-	def get_variation(self,line_num):
-		"""Returns list of variations for line 'line_num'"""
-		return self._do_line(line_num)
-
+		self._varied = (self.means != 0.0) & (self.sds > 0.0)
+		self._switch = self._varied & (self.means < 0.0)
+		# harmless values for the cells that are not varied
+		ms = np.where(self._varied, np.abs(self.means), 0.5)
+		ss = np.where(self._varied, self.sds, 0.1)
+		self._alpha = ((1 - ms) / ss ** 2 - (1 / ms)) * ms ** 2
+		self._beta = self._alpha * (1 / ms - 1)
+
+	def base_shape(self):
+		"""Shape of the basic random values for one variation"""
+		if self.correlation == 'block':
+			return (self.file_data['blocksPerGroup'], self.cols)
+		elif self.correlation == 'row':
+			return (len(self.data_lines), 1)
+		return self.means.shape
+
+	def draw_base(self, random_generator):
+		"""Return the basic random values for one variation"""
+		if self.distribution in ('beta', 'lognormal'):
+			return random_generator.random(self.base_shape())   # uniform [0, 1]
+		return random_generator.standard_normal(self.base_shape())
+
+	def base_from_uniform(self, u):
+		"""Convert uniforms to basic random values"""
+		if self.distribution in ('beta', 'lognormal'):
+			return u
+		return special.ndtri(u)
+
+	def reflect(self, rnd):
+		"""Return the antithetic counterparts of basic random values rnd"""
+		if self.distribution in ('beta', 'lognormal'):
+			return 1 - rnd
+		return -rnd
+
+	def expand(self, rnd):
+		"""Return basic random values rnd with one value for each cell.
+
+		rnd may have leading dimensions, e.g., for iterations."""
+		if self.correlation == 'block':
+			return rnd[..., self.block_nums, :]
+		return np.broadcast_to(rnd, rnd.shape[:-2] + self.means.shape)
+
+	def _correlated_normal(self, e):
+		"""Return <np.array> of normals.
+
+		e are error terms from the standard normal, one per cell.
+		"""
+		return self.means + e*self.sds
 
-	def vary_individually(self,line_num):
-		sds = [float(sd) for sd in self.lines[line_num].split()[self.row_offset:]]
-		means = [float(mean) for mean in self.mean_lines[line_num].split()[self.row_offset:]]
-		return self._do_dist(means, sds)
+	def _correlated_lognormal(self, q):
+		"""Return <np.array> of log-normals.
 
+		q are the quantiles to use, one per cell.
+		Each individual element has mean and sd as given in the input.
+		"""
+		# scipy docs say if log(Y) has mean mu and sd sigma then
+		# use s = sigma and scale = exp(mu)
+		res = stats.lognorm.ppf(q, s = self._sigma, scale = np.exp(self._mu))
+		# if sd=0 use original mean
+		return np.where(self._varied, res, self.means)
 
-	def vary_by_row(self,line_num):		
-		rnd = self._rnd
-		# prepare for next call
-		self._rnd = self._basic_generator()
-		sds = [float(sd) for sd in self.lines[line_num].split()[self.row_offset:]]
-		means = [float(mean) for mean in self.mean_lines[line_num].split()[self.row_offset:]]
-		return self._do_dist(rnd, means, sds)
+	def _correlated_beta(self, q):
+		"""Return <np.array> of beta random variables.
 
-	def vary_by_block(self,line_num):
-		"""return <np.array> of parameters for indicated line
-		All rows within a column in the same block will return the same quantile.
+		q are the quantiles to use, one per cell.
+		Each individual element has mean and sd as given in the input.
+		"""
+		res = stats.beta.ppf(q, a = self._alpha, b = self._beta)
+		res = np.where(self._switch, -res, res)
+		return np.where(self._varied, res, self.means)
 
-		It might be a good idea to sanity check the inputs, though it's a little silly to do
-		for each simulation.
+	def get_variation(self, rnd):
+		"""Returns <np.array> of varied values, one row per data line.
 
-		self._rnd are standard normal deviates for normal distributions and 
-		quantiles in [0, 1] for other distributions.
+		rnd are basic random values, as from draw_base().
+		They may have a leading dimension for iterations, in which case
+		so does the result.
 		"""
-		block_num = self.get_block_num(line_num)
-		sds = np.array([float(sd) for sd in self.lines[line_num].split()[self.row_offset:]])
-		means = np.array([float(mean) for mean in self.mean_lines[line_num].split()[self.row_offset:]])
-		return self._do_dist(self._rnd[block_num,], means, sds)
+		return self._do_dist(self.expand(rnd))
 
 
 
@@ -448,23 +850,34 @@ class InpFile(VFile):
 
 	Attr:
 		effects: Effects object containing variation data
+		varied_lines: List of (line_num, key, mean) for each template line
+			containing a key; mean is None unless the key uses the MEAN option.
+			Computed once, so each variation only rewrites these lines.
 	"""
 
-	def __init__(self,fname):
+	def __init__(self,fname,effects):
 		VFile.__init__(self,fname + '.inp')
-		self.effects = Effects()
+		self.effects = effects
 		self.frmt_str = '{:<8.6f}'
 		self.lead_spaces = 0
 		self.fileprefix = fname
+		self.varied_lines = self._index_varied_lines()
+
+	def _index_varied_lines(self):
+		varied_lines = []
+		for line_num,line in enumerate(self.template):
+			key = self.effects.find_key(line)
+			if key is not None:
+				mean = None
+				if self.effects.adds_mean(key):
+					mean = float(line.split()[0])
+				varied_lines.append((line_num,key,mean))
+		return varied_lines
 
-	def vary_line(self,line_num):
-		line = self.lines[line_num]
-
-		line_data = self.effects.get_data(line)
-
-		if line_data != None:
-			varied,add_mean = line_data
-			mean = float(line.split()[0])
+	def vary(self):
+		self.lines = list(self.template)
+		for line_num,key,mean in self.varied_lines:
+			varied,add_mean = self.effects.key_result_pairs[key]
 
 			if add_mean:
 				varied = mean + mean * varied
@@ -473,7 +886,7 @@ class InpFile(VFile):
 			self.replace_line(formatted,line_num)
 
 	def count_varied_lines(self):
-		varied_line_counts = self.effects.key_matches(self.lines)
+		varied_line_counts = self.effects.key_matches(self.template)
 		counts = [value for key,value in varied_line_counts.items()]
 		format_str = '{:<16}  ' * (len(counts) + 1)
 		if len(counts) > 0:
@@ -484,29 +897,84 @@ class InpFile(VFile):
 class Effects(object):
 	"""Contains data from inp_distribution.txt
 
-	Used to vary .inp file.
+	Used to vary .inp files.  The same values are used for every .inp file.
 	inp_distribution.txt format can be found on github.com/ecfairle/CHDMOD
 	Attr:
 		key_result_pairs: Dict of key->data pairs - where
 			key_result_pairs[key][0]' replaces the value on the current line
 			and 'key_result_pairs[key][1]' indicates whether to add the mean
 			on the current line
+		key_components: Dict of key->list of Components summed for that key
 		lines: Raw lines of inp_distribution.txt
+		key_re: Compiled regular expression matching any key
+		slots: Names of the random number streams, one per group and one per
+			ungrouped component.  Each supplies one uniform per simulation.
+
+	All components are sampled together, for any number of simulations,
+	by transforming the uniforms with their inverse CDFs.  Components of
+	the same group share a uniform, and so are perfectly correlated even
+	if their distributions differ.
 	"""
 
 	save_file_name = 'MC\input_variation\inp.txt'
+	archive_name = 'inp'
 
 	def __init__(self):
 		self.key_result_pairs = collections.OrderedDict()
+		self.key_components = collections.OrderedDict()
 		self.lines = []
 		self._read_lines()
-		self._generate_pairs()
-
-	def print_data(self):
-		vals = [data[0] for key,data in self.key_result_pairs.items()]
+		self._generate_components()
+		self._compile_keys()
+		self._compile_components()
+		for key in self.key_components:
+			self.key_result_pairs[key] = (0.0,self.adds_mean(key))
+
+	def draw_base(self,streams,iteration):
+		"""Return <np.array> of the uniforms for each slot"""
+		return np.array([streams.generator(iteration,slot).random()
+						for slot in self.slots])
+
+	def transform(self,u):
+		"""Return <np.array> of the value for each key.
+
+		u are uniforms for each slot, as from draw_base, possibly with
+		leading dimensions for simulations.  The result has the same
+		leading dimensions."""
+		u = u[...,self._slot_of]
+		z = special.ndtri(u)
+		vals = np.empty_like(u)
+		for name,idx in self._by_dist.items():
+			vals[...,idx] = Component.inverse_cdfs[name](u[...,idx],z[...,idx],
+														self._p1[idx],self._p2[idx])
+		vals = np.clip(vals,self._lower,self._upper)
+		return vals.dot(self._membership)
+
+	def get_draw(self):
+		"""Return <np.array> of the current value for each key"""
+		return np.array([data[0] for key,data in self.key_result_pairs.items()])
+
+	def set_draw(self,values):
+		"""Use values, as returned by get_draw, for the keys"""
+		for key,value in zip(list(self.key_result_pairs),values):
+			self.key_result_pairs[key] = (value,self.key_result_pairs[key][1])
+
+	def print_data(self,label=None):
+		"""Save current values, preceded by label if given"""
+		self.save_write(self.format_data(self.get_draw(),label))
+
+	def format_data(self,vals,label=None):
+		"""Return line of inp.txt for vals, empty if there are no keys"""
 		format_str = '{:<16.7f}  ' * len(vals)
+		if label is not None:
+			format_str = '{:<16}  '.format(label) + format_str
 		if len(vals) > 0:
-			self.save_write(format_str.format(*vals) + '\n')
+			return format_str.format(*vals) + '\n'
+		return ''
+
+	def save_raw_data(self,archive,iteration):
+		"""Record the current values in archive"""
+		archive.write(self.archive_name,self.key_components,iteration,[self.get_draw()])
 
 	def print_labels(self):
 		labels = [key for key in self.key_result_pairs]
@@ -531,7 +999,7 @@ class Effects(object):
 	def num_lines(self):
 		return len(self.lines)
 
-	def _generate_pairs(self):
+	def _generate_components(self):
 		# ignore everything after '#'
 		line_num = 0
 		while line_num < self.num_lines():
@@ -541,54 +1009,106 @@ class Effects(object):
 			component_lines = self.lines[line_num + 1:line_num + num_lines + 1]
 			line_num += num_lines + 1  # skip past component lines
 
-			self.key_result_pairs[key] = self._sum_components(component_lines)
-
-	def _sum_components(self,component_lines):
-		"""Sum samples from each component distribution"""
-		s = 0
-		add_mean = False
-		for line in component_lines:
-			component = Component(line)
-			s += component.sample()
-			add_mean = component.depends_on_mean_line()
-
-		if add_mean and len(component_lines) != 1:
-			print('error: the MEAN placeholder only makes sense when '
-				'the label contains a single component')
+			components = [Component(line) for line in component_lines]
+			if len(components) != 1 and \
+				any(c.depends_on_mean_line() for c in components):
+				print('error: the MEAN placeholder only makes sense when '
+					'the label contains a single component')
+				sys.exit(1)
+			self.key_components[key] = components
+
+	def _compile_components(self):
+		"""Set up arrays describing every component for transform()"""
+		self.slots = []
+		slot_of = []
+		key_of = []
+		dists = []
+		params = []
+		bounds = []
+		for k,(key,components) in enumerate(self.key_components.items()):
+			for n,component in enumerate(components):
+				slot = component.stream_name(key,n)
+				if slot not in self.slots:
+					self.slots.append(slot)
+				slot_of.append(self.slots.index(slot))
+				key_of.append(k)
+				dists.append(component.name)
+				params.append(component.get_params())
+				bounds.append((component.lower_bound,component.upper_bound))
+		self._slot_of = np.array(slot_of,dtype=int)
+		# component x key matrix summing components into keys
+		self._membership = np.zeros((len(key_of),len(self.key_components)))
+		self._membership[np.arange(len(key_of)),key_of] = 1.0
+		params = np.array(params,dtype=float).reshape(-1,2)
+		self._p1, self._p2 = params[:,0], params[:,1]
+		bounds = np.array(bounds,dtype=float).reshape(-1,2)
+		self._lower, self._upper = bounds[:,0], bounds[:,1]
+		self._by_dist = {}
+		for name in set(dists):
+			self._by_dist[name] = np.array([i for i,d in enumerate(dists) if d == name])
+
+	def _compile_keys(self):
+		"""Set key_re, trying longer keys first"""
+		keys = sorted(self.key_components,key=len,reverse=True)
+		self.key_re = re.compile('|'.join(re.escape(key) for key in keys))
+
+	def adds_mean(self,key):
+		"""True if the value for key is relative to the mean on the line"""
+		return self.key_components[key][0].depends_on_mean_line()
+
+	def keys_in(self,line):
+		"""Return list of all keys found in line"""
+		if not self.key_components or self.key_re.search(line) is None:
+			return []
+		# only lines with some key get checked for all of them
+		return [key for key in self.key_components if line.find(key) != -1]
+
+	def find_key(self,line):
+		"""Return the key found in line, else None"""
+		keys = self.keys_in(line)
+		if len(keys) > 1:
+			print('keys overlap -- keys must be unique to'
+								 'achieve desired behavior')
 			sys.exit(1)
-
-		return s, add_mean
-
-	def get_data(self,line):
-		"""Return varied value appropriate for line, else None"""
-		for key,varied in self.key_result_pairs.items():
-			if line.find(key) != -1:
-				self._test_for_repeats(key,line)
-				return varied
-		return None
+		return keys[0] if keys else None
 
 	def key_matches(self,lines):
 		matches_by_key = collections.OrderedDict()
-		for key in self.key_result_pairs:
+		for key in self.key_components:
 			matches_by_key[key] = 0
 		for line in lines:
-			for key,varied in self.key_result_pairs.items():
-				if line.find(key) != -1:
-					matches_by_key[key]+=1
+			for key in self.keys_in(line):
+				matches_by_key[key]+=1
 		return matches_by_key
 
-	def _test_for_repeats(self,key,line):
-		"""Make only one key found in line"""
-		other_keys = [k for k in self.key_result_pairs.keys() if k != key]
-		if any(line.find(k) != -1 for k in other_keys):
-			print('keys overlap -- keys must be unique to'
-								 'achieve desired behavior')
-			sys.exit(1)
+
+def _normal_ppf(u, z, mean, sd):
+	return mean + sd * z
+
+def _lognormal_ppf(u, z, mean, sigma):
+	# same parameters as numpy's lognormal: those of the underlying normal
+	return np.exp(mean + sigma * z)
+
+def _beta_ppf(u, z, a, b):
+	return stats.beta.ppf(u, a, b)
+
+def _gamma_ppf(u, z, shape, scale):
+	return stats.gamma.ppf(u, shape, scale=scale)
 
 
 class Component(object):
+	"""One line of a key's section in inp_distribution.txt
 
-	group_state = {}
+	Attr:
+		name: distribution, one of the keys of inverse_cdfs
+		params: list of the 2 distribution parameters, or the coefficient
+			of variation if use_mean
+		group: name of the group, None if ungrouped
+	"""
+
+	# functions of uniforms u, the matching standard normals z and the parameters
+	inverse_cdfs = {'NORMAL': _normal_ppf, 'LOGNORMAL': _lognormal_ppf,
+					'BETA': _beta_ppf, 'GAMMA': _gamma_ppf}
 
 	def __init__(self,data_line):
 		parts = data_line.split(',')
@@ -606,8 +1126,8 @@ class Component(object):
 			self.set_dist(parts[0])
 			params = parts[1:]
 
-		if self.name == 'NORMAL' and params[0].upper() == 'MEAN':
-			self.fn = RG.randn
+		self.use_mean = self.name == 'NORMAL' and params[0].upper() == 'MEAN'
+		if self.use_mean:
 			self.params = float(params[1])
 		else:
 			self.params = [float(p) for p in params[:self.num_params]]
@@ -617,18 +1137,26 @@ class Component(object):
 		self.upper_bound = self.get_upper(bounds)
 
 	def depends_on_mean_line(self):
-		return self.fn == RG.randn
+		return self.use_mean
+
+	def get_params(self):
+		"""Return the 2 parameters for inverse_cdfs"""
+		if self.use_mean:
+			# mean + mean * N(0, cv)
+			return [0.0, self.params]
+		return self.params
+
+	def stream_name(self,key,n):
+		"""Name of the random number stream for the n'th component of key"""
+		if self.group:
+			return 'group:' + self.group
+		return 'effect:{}:{}'.format(key,n)
 
 	def set_group(self,group_str):
 		"""Sets group for component, returns True if successful"""
-		# here I get state from new RG.  Motivation for using it remains
-		# obscure.
 		match = re.search(r'g=(.+)',group_str)
 		if match is not None:
 			self.group = match.group(1).strip()
-			if not self.group in self.group_state:
-				self.group_state[self.group] = RG.state
-				# RB: Why isn't this the same for every group?
 			return True
 		return False
 
@@ -650,45 +1178,23 @@ class Component(object):
 		dist_name = dist_name.lower()
 		if dist_name == 'norm' or dist_name == 'normal' or dist_name == '':
 			self.name = 'NORMAL'
-			self.fn = RG.normal
 			self.num_params = 2
 
 		elif dist_name == 'lognormal':
 			self.name = 'LOGNORMAL'
-			self.fn = RG.lognormal
 			self.num_params = 2
 
 		elif dist_name == 'beta' or dist_name == 'b':
 			self.name = 'BETA'
-			self.fn = RG.beta
 			self.num_params = 2
 
 		elif dist_name == 'gamma':
 			self.name = 'GAMMA'
-			self.fn = RG.gamma
 			self.num_params = 2
 
 		else:
 			invalid_distribution_error(dist_name)
 
-	def sample(self):
-		if self.group:
-			RG.state = self.group_state[self.group]
-
-		if self.fn == RG.randn:
-			val = self.fn() * self.params
-		else:
-			val = self.fn(*self.params)
-
-		return self.threshold(val)
-
-	def threshold(self,val):
-		if val > self.upper_bound:
-			return self.upper_bound
-		elif val < self.lower_bound:
-			return self.lower_bound
-		else:
-			return val
 
 
 if __name__ == '__main__':
@@ -1,22 +1,28 @@
 import matplotlib.pyplot as plt
 import numpy as np
-import pandas
 import sys
 import os
+from draws import DrawArchive
 
 PLOT_DIR = "MC/results/plots"
 
 basename = sys.argv[1]
-index = int(sys.argv[2])
-fname = 'MC/input_variation/dat_files/{}.csv'.format(basename)
+index = sys.argv[2]
 try:
-	data = pandas.read_csv(fname, header=None)
+	labels, data = DrawArchive().read(basename)
 except IOError as e:
-	print("File {} does not exist".format(fname))
+	print(e)
 	sys.exit()
 
-data_col = data[index]
-plt.hist(data_col.tolist())
+# the slot may be given by its number or its label, e.g. line3_col2
+if index in labels:
+	index = labels.index(index)
+else:
+	index = int(index)
+data_col = data[:, index]
+# row 0 is the zero run and rows not run are NaN
+data_col = data_col[1:][~np.isnan(data_col[1:])]
+plt.hist(data_col)
 fig = plt.gcf()
 plt.show()
 if not os.path.isdir(PLOT_DIR):
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+"""Dense memory-mapped cube of the results in a frmtToData.py database
+
+The cube is a float64 array with axes
+	scenario x iSim x variable x year x demo
+in C order, in <dir>/cube.f8, and the labels of each axis in <dir>/cube.json.
+Variables are the (name, subCat) pairs of the fullvar table, subCat '-' for
+the primary outcome.  Row i of the iSim axis holds simulation i; anything
+not in the database is NaN.  Write it with frmtToData.py --cube DIR, or
+	python results.py allData.db DIR
+and read it with
+	cube = results.open(DIR)
+	deaths = cube.sel(var='DEATHS', scenario='base', years=range(2020, 2030))
+	deaths.sum(axis=1).mean(axis=0)		# per demographic group
+sel returns views of the memmap, not copies, as long as each selection is a
+single label or a run of consecutive labels.
+
+The cube is dense, so it takes 8 bytes for every combination of the axes;
+check shape before building one for a large run.
+"""
+from __future__ import print_function
+import argparse
+import io
+import json
+import os.path
+import sqlite3
+import numpy as np
+
+CUBE_NAME = 'cube'
+AXES = ('scenario', 'iSim', 'var', 'year', 'demo')
+
+
+def _paths(directory):
+	base = os.path.join(directory, CUBE_NAME)
+	return base + '.f8', base + '.json'
+
+
+def _to_float(values):
+	"""Return values as a float array; NULL, or text SQLite kept as is, becomes NaN"""
+	try:
+		return np.asarray(values, dtype=np.float64)
+	except (TypeError, ValueError):
+		return np.vectorize(lambda v: v if isinstance(v, (int, float)) else np.nan, otypes=[np.float64])(
+			np.asarray(values, dtype=object))
+
+
+def write_cube(directory, conn, batch=1 << 20):
+	"""Write the cube of the database open on conn to directory; return its shape"""
+	c = conn.cursor()
+	wide = bool(c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='yeardata';").fetchone())
+	if wide:
+		scenarios = [r[0] for r in c.execute('SELECT name FROM scenario ORDER BY name;')]
+		iSimMax = c.execute('SELECT max(iSim) FROM yeardata;').fetchone()[0]
+		years = [r[0] for r in c.execute('SELECT DISTINCT year FROM yeardata ORDER BY year;')]
+	else:
+		scenarios = [r[0] for r in c.execute('SELECT DISTINCT scenario FROM data ORDER BY scenario;')]
+		iSimMax = c.execute('SELECT max(iSim) FROM data;').fetchone()[0]
+		years = [r[0] for r in c.execute('SELECT DISTINCT year FROM data ORDER BY year;')]
+	fullvars = c.execute('SELECT fullvarid, name, subCat FROM fullvar JOIN variable USING (varid) '
+						'ORDER BY fullvarid;').fetchall()
+	demo = [r[0] for r in c.execute('SELECT label FROM demo WHERE demoid <= 12 ORDER BY demoid;')]
+	shape = (len(scenarios), (iSimMax or 0) + 1, len(fullvars), len(years), len(demo))
+
+	# positions along each axis
+	scenarioPos = {s: i for i, s in enumerate(scenarios)}
+	fullvarPos = np.zeros(max([f[0] for f in fullvars] + [0]) + 1, dtype=np.intp)
+	fullvarPos[[f[0] for f in fullvars]] = np.arange(len(fullvars))
+	yearPos = {y: i for i, y in enumerate(years)}
+
+	if not os.path.isdir(directory):
+		os.makedirs(directory)
+	datapath, sidecar = _paths(directory)
+	if os.path.exists(sidecar):
+		# readers must not see the new data with the old labels
+		os.remove(sidecar)
+	cube = np.memmap(datapath, dtype=np.float64, mode='w+', shape=shape)
+	cube[...] = np.nan
+	if wide:
+		q = c.execute('SELECT scenario.name, iSim, fullvarid, year, {} FROM yeardata JOIN scenario USING (scenarioid);'.format(
+			', '.join('v{}'.format(i) for i in range(1, 13))))
+	else:
+		q = c.execute('SELECT scenario, iSim, fullvarid, year, demoid, value FROM data;')
+	while True:
+		rows = q.fetchmany(batch)
+		if not rows:
+			break
+		cols = list(zip(*rows))
+		iS = np.array([scenarioPos[s] for s in cols[0]], dtype=np.intp)
+		iSim = np.array(cols[1], dtype=np.intp)
+		iVar = fullvarPos[np.array(cols[2], dtype=np.intp)]
+		iYear = np.array([yearPos[y] for y in cols[3]], dtype=np.intp)
+		if wide:
+			# NULLs, from short lines, become NaN
+			cube[iS, iSim, iVar, iYear, :] = _to_float([r[4:] for r in rows])
+		else:
+			cube[iS, iSim, iVar, iYear, np.array(cols[4], dtype=np.intp) - 1] = _to_float(cols[5])
+	cube.flush()
+	del cube
+	with io.open(sidecar, 'w') as f:
+		json.dump({'shape': shape, 'dtype': 'float64', 'scenario': scenarios,
+				'var': [[name, subCat] for _, name, subCat in fullvars],
+				'year': years, 'demo': demo}, f)
+	return shape
+
+
+def open(directory):
+	"""Return the <Cube> in directory"""
+	return Cube(directory)
+
+
+class Cube(object):
+	"""Read-only results cube
+
+	Attr:
+		data: the whole array, a read-only memmap
+		labels: Dict of axis name -> list of labels; var labels are (name, subCat)
+	"""
+
+	def __init__(self, directory):
+		datapath, sidecar = _paths(directory)
+		if not os.path.isfile(sidecar):
+			raise IOError('No results cube in {}'.format(directory))
+		# io.open, since this module's open is the one returning a Cube
+		with io.open(sidecar) as f:
+			meta = json.load(f)
+		shape = tuple(meta['shape'])
+		self.data = np.memmap(datapath, dtype=np.float64, mode='r', shape=shape)
+		self.labels = {'scenario': meta['scenario'], 'iSim': list(range(shape[1])),
+					'var': [tuple(v) for v in meta['var']], 'year': meta['year'], 'demo': meta['demo']}
+
+	@property
+	def shape(self):
+		return self.data.shape
+
+	def _index(self, axis, wanted):
+		"""Return the index along axis for wanted: a label, or an iterable of labels.
+		Runs of consecutive labels become slices, so the result is a view."""
+		labels = self.labels[axis]
+		if axis == 'var':
+			key = lambda v: (v, '-') if isinstance(v, str) else tuple(v)
+		else:
+			key = lambda v: v
+		if wanted is None:
+			return slice(None)
+		# on the var axis a tuple is one label, (name, subCat)
+		if isinstance(wanted, str) or (axis == 'var' and isinstance(wanted, tuple)) or \
+				not hasattr(wanted, '__iter__'):
+			return self._position(axis, labels, key(wanted))
+		positions = [self._position(axis, labels, key(w)) for w in wanted]
+		if positions and positions == list(range(positions[0], positions[0] + len(positions))):
+			return slice(positions[0], positions[0] + len(positions))
+		return positions
+
+	@staticmethod
+	def _position(axis, labels, label):
+		try:
+			return labels.index(label)
+		except ValueError:
+			raise KeyError('No {} {!r} in the results cube'.format(axis, label))
+
+	def sel(self, scenario=None, iSim=None, var=None, years=None, demo=None):
+		"""Return the values for the given labels, None meaning all of them
+
+		Each argument is a single label, which drops that axis, or an iterable
+		of labels.  A var is a name, for the primary outcome, or (name, subCat).
+		The result is a view of the memmap unless some selection is a list of
+		labels that are not consecutive; those are applied one axis at a time.
+		"""
+		index = [self._index(axis, wanted) for axis, wanted in
+				zip(AXES, (scenario, iSim, var, years, demo))]
+		basic = tuple(slice(None) if isinstance(i, list) else i for i in index)
+		result = self.data[basic]
+		# axes still present after the basic indexing, for the lists
+		axis = 0
+		for i in index:
+			if isinstance(i, list):
+				result = result.take(i, axis=axis)
+			if not isinstance(i, int):
+				axis += 1
+		return result
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Write the results cube of a frmtToData.py database')
+	parser.add_argument('database', help='database written by frmtToData.py')
+	parser.add_argument('directory', help='where to put cube.f8 and cube.json')
+	args = parser.parse_args()
+	conn = sqlite3.connect(args.database)
+	try:
+		shape = write_cube(args.directory, conn)
+	finally:
+		conn.close()
+	print('Wrote {} cube {} to {}'.format(' x '.join(AXES), shape, args.directory))
+
+
+if __name__ == '__main__':
+	main()
@@ -11,15 +11,17 @@ import re
 INP_FILE_LIST = 'MC/inputs/input_data.json'
 DATFILE_DIR = 'MC/results/cumulative'
 INP_OUTPUTS = 'MC/input_variation/inp.txt'
+SAMPLING_FILE = 'MC/input_variation/sampling.json'
 
 
 def main():
 	with open(INP_FILE_LIST,'r') as f:
 		input_data = json.load(f)
 
+	antithetic = is_antithetic()
 	inp_files = input_data['inp_files']
 	for inp_file_name in inp_files:
-		inp_file = InpFile(inp_file_name)
+		inp_file = InpFile(inp_file_name,antithetic)
 
 		inp_file.csv_dump()
 
@@ -28,8 +30,10 @@ def main():
 			lines = f.readlines()
 			
 		res = []
+		sims = []
 		for line in lines[1+len(inp_files):]:
 			res.append([float(v) for v in line.split()[1:]])
+			sims.append(line.split()[0])
 		means = np.mean(np.array(res),axis=0).tolist()
 		sds = np.std(np.array(res),axis=0).tolist()
 		
@@ -37,6 +41,34 @@ def main():
 		with open(INP_OUTPUTS,'a') as f:
 			f.write(format_str.format('means', *means) + '\n')
 			f.write(format_str.format('sds', *sds) + '\n')
+			if antithetic:
+				pair_means,pair_ses = pair_stats(sims,res)
+				f.write(format_str.format('pair_means', *pair_means) + '\n')
+				f.write(format_str.format('pair_ses', *pair_ses) + '\n')
+
+def is_antithetic():
+	"""True if montecarlo.py drew the inputs in antithetic pairs"""
+	if not isfile(SAMPLING_FILE):
+		return False
+	with open(SAMPLING_FILE,'r') as f:
+		return json.load(f).get('antithetic',False)
+
+def pair_stats(sims,data):
+	"""Return mean and standard error of the mean for antithetic pairs.
+
+	sims are the simulation numbers of the rows of data.  Simulations 2k-1
+	and 2k form pair k; the pair averages are independent, so the standard
+	error is their sd over the square root of the number of pairs.
+	Simulations without a partner, including the zero run, are ignored.
+	"""
+	rows = {int(sim) : np.asarray(row,dtype=float) for sim,row in zip(sims,data) if str(sim).isdigit()}
+	pairs = [(rows[k] + rows[k+1])/2 for k in sorted(rows) if k % 2 == 1 and k+1 in rows]
+	if len(pairs) == 0:
+		nan = np.full(len(data[0]),np.nan)
+		return nan,nan
+	pairs = np.array(pairs)
+	ses = np.std(pairs,axis=0,ddof=1)/np.sqrt(len(pairs)) if len(pairs) > 1 else np.full(pairs.shape[1],np.nan)
+	return np.mean(pairs,axis=0),ses
 
 def atoi(text):
     return int(text) if text.isdigit() else text
@@ -47,8 +79,9 @@ def natural_keys(text):
 
 class InpFile(object):
 
-	def __init__(self,fname):
+	def __init__(self,fname,antithetic=False):
 		self.fname = fname
+		self.antithetic = antithetic
 		self.sim_files = self.get_sim_files()
 		self.labels = list(self.sim_files[0].data_rows)
 
@@ -67,6 +100,8 @@ class InpFile(object):
 				    a.writerow(['File', 'Simulation Number'] + self.sim_files[0].headers)
 				    a.writerow([self.fname, 'Mean'] + means.tolist())
 				    a.writerow([self.fname, 'Standard Deviation'] + sds.tolist())
+				    for row in self.pair_rows(label):
+				    	a.writerow(row)
 				    for file_name, data in zip(self.files[label],self.data[label]):
 				    	prefix,sim_number = file_name.split('_')
 				    	a.writerow([self.fname, sim_number] + data.tolist())
@@ -76,10 +111,21 @@ class InpFile(object):
 				    a.writerow(['File', 'Simulation Number'] + self.sim_files[0].headers)
 				    a.writerow([self.fname, 'Mean'] + means.tolist())
 				    a.writerow([self.fname, 'Standard Deviation'] + sds.tolist())
+				    for row in self.pair_rows(label):
+				    	a.writerow(row)
 				    for file_name, data in zip(self.files[label],self.data[label]):
 				    	prefix,sim_number = file_name.split('_')
 				    	a.writerow([self.fname, sim_number] + data.tolist())
 
+	def pair_rows(self,label):
+		"""Rows with the antithetic pair mean and standard error, if any"""
+		if not self.antithetic:
+			return []
+		sims = [file_name.split('_')[1] for file_name in self.files[label]]
+		means,ses = pair_stats(sims,self.data[label])
+		return [[self.fname, 'Pair Mean'] + means.tolist(),
+				[self.fname, 'Pair Standard Error'] + ses.tolist()]
+
 	def plot(self,col,label):
 		plt.hist(np.array(self.data[label])[:,0])
 		plt.show()